@@ -0,0 +1,301 @@
+import gc
+import os
+import glob
+import json
+import time
+import argparse
+import logging
+import resource
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from datev_complete_scraper import CompleteDATEVScraper
+from datev_export import export_records
+from datev_fetchers import SeleniumSearchFetcher
+from datev_fixtures import CITIES, load_recorded_pages, synthetic_result_pages
+from datev_parser import extract_result_blocks, parse_advisor_blocks
+from datev_replay_server import ReplayServer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _rate(count, seconds):
+    return round(count / seconds, 1) if seconds else 0.0
+
+
+def _memory_per_record(build):
+    """Bytes held per record by the list that build() returns"""
+    gc.collect()
+    tracemalloc.start()
+    records = build()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return round(current / len(records)) if records else 0
+
+
+def benchmark_parse(pages, repeat=3):
+    """Extraction and parse throughput and memory per record over a corpus of result pages"""
+    if repeat < 1:
+        raise ValueError(f"repeat must be at least 1, got {repeat}")
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        blocks = [block.lines for page in pages for block in extract_result_blocks(page)]
+    extract_seconds = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        records = parse_advisor_blocks(blocks)
+    parse_seconds = (time.perf_counter() - start) / repeat
+
+    return {
+        'pages': len(pages),
+        'blocks': len(blocks),
+        'records': len(records),
+        'extract_pages_per_sec': _rate(len(pages), extract_seconds),
+        'extract_blocks_per_sec': _rate(len(blocks), extract_seconds),
+        'parse_blocks_per_sec': _rate(len(blocks), parse_seconds),
+        'bytes_per_record': _memory_per_record(lambda: parse_advisor_blocks(blocks)),
+        'bytes_per_record_no_full_text': _memory_per_record(
+            lambda: parse_advisor_blocks(blocks, keep_full_text=False)),
+        'bytes_per_record_as_dict': _memory_per_record(
+            lambda: [record.to_dict() for record in parse_advisor_blocks(blocks)]),
+    }
+
+
+def _peak_rss_mb():
+    """Peak resident memory of this process, and the largest peak of its finished children (e.g. Chrome)"""
+    # Two independent maxima, so they are reported apart rather than added up
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def run_pipeline(backend, base_url, export_formats=('xlsx', 'csv'), verbose=False, pipelined=False, workers=1,
+                 schedule='fixed'):
+    """Run get_all_contacts_comprehensive against base_url and measure it; runs in its own process"""
+    if not verbose:
+        logging.getLogger('datev_complete_scraper').setLevel(logging.WARNING)
+        logging.getLogger('datev_pipeline').setLevel(logging.WARNING)
+        logging.getLogger('datev_scheduler').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        scraper = CompleteDATEVScraper(headless=True, backend=backend, base_url=base_url, min_interval=0, jitter=0,
+                                       cache_path=None, state_path=os.path.join(workdir, 'crawl.sqlite'),
+                                       pipelined=pipelined, workers=workers, schedule=schedule)
+        try:
+            start = time.perf_counter()
+            scraper.get_all_contacts_comprehensive()
+            crawl_seconds = time.perf_counter() - start
+
+            exports = {}
+            for fmt in export_formats:
+                filename = os.path.join(workdir, f"contacts.{fmt}")
+                try:
+                    exports[fmt] = export_records(scraper.record_store.records(), filename)
+                except RuntimeError as e:
+                    exports[fmt] = {'error': str(e)}
+
+            searches = scraper.work_queue.counts().get('done', 0)
+            phases = scraper.timer.summary()
+            extract = phases.get('extract', {'count': 0, 'total': 0.0})
+            minutes = crawl_seconds / 60
+            return {
+                'backend': backend,
+                'pipelined': scraper.pipelined,
+                'workers': workers,
+                'schedule': schedule,
+                'crawl_seconds': round(crawl_seconds, 2),
+                'searches': searches,
+                'requests': scraper.rate_limiter.requests,
+                'queries_per_min': round(searches / minutes, 1) if minutes else 0.0,
+                'unique_records': len(scraper.all_contacts),
+                'unique_records_per_min': round(len(scraper.all_contacts) / minutes, 1) if minutes else 0.0,
+                'parse_pages_per_sec': _rate(extract['count'], extract['total']),
+                'peak_rss_mb': _peak_rss_mb(),
+                'export': exports,
+                'phases': phases,
+                'stages': scraper.pipeline_stats,
+                'families': scraper.family_stats,
+                'strategies': scraper.metrics.snapshot()['strategies'],
+            }
+        finally:
+            scraper.close()
+
+
+def _percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def _process_tree_rss_mb(pid):
+    """Resident memory of a process and all its descendants, e.g. chromedriver and Chrome (Linux only)"""
+    children = {}
+    rss_kb = {}
+    page_kb = os.sysconf('SC_PAGE_SIZE') / 1024
+    for stat_path in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat_path) as f:
+                # Fields after the command name: state, ppid, ..., rss at index 21
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        process = int(stat_path.split('/')[2])
+        children.setdefault(int(fields[1]), []).append(process)
+        rss_kb[process] = int(fields[21]) * page_kb
+
+    total = 0.0
+    pending = [pid]
+    while pending:
+        process = pending.pop()
+        total += rss_kb.get(process, 0.0)
+        pending.extend(children.get(process, []))
+    return round(total / 1024, 1)
+
+
+def benchmark_browser(queries=30, advisors=2000, latency=0.0, modes=('default', 'lean')):
+    """Per-search latency, server requests and browser memory of the Selenium backend, default vs lean mode"""
+    server = ReplayServer(advisors, latency).start()
+    searches = [{'postal_code': postal_code[:2]} for postal_code, _ in CITIES]
+    reports = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for mode in modes:
+                lean = mode == 'lean'
+                logger.info(f"Running {queries} searches with the {mode} Selenium backend against {server.url}")
+                fetcher = SeleniumSearchFetcher(server.url, headless=True, lean=lean,
+                                                profile_dir=os.path.join(workdir, mode) if lean else None)
+                try:
+                    # Browser launch and first search, which also warms the profile
+                    start = time.perf_counter()
+                    fetcher.fetch(searches[0])
+                    first_seconds = time.perf_counter() - start
+
+                    requests_before = server.requests
+                    latencies = []
+                    for i in range(queries):
+                        start = time.perf_counter()
+                        fetcher.fetch(searches[i % len(searches)])
+                        latencies.append(time.perf_counter() - start)
+
+                    reports[mode] = {
+                        'first_search_seconds': round(first_seconds, 3),
+                        'mean_seconds': round(sum(latencies) / len(latencies), 3),
+                        'p50_seconds': round(_percentile(latencies, 0.5), 3),
+                        'p95_seconds': round(_percentile(latencies, 0.95), 3),
+                        'server_requests_per_search': round((server.requests - requests_before) / queries, 2),
+                        'browser_rss_mb': _process_tree_rss_mb(fetcher.driver.service.process.pid),
+                        'phases': fetcher.timer.summary(),
+                    }
+                except Exception as e:
+                    reports[mode] = {'error': str(e)}
+                finally:
+                    fetcher.close()
+    finally:
+        server.stop()
+    return {'queries': queries, 'advisors': advisors, 'latency': latency, 'modes': reports}
+
+
+def benchmark_pipeline(backends, advisors=5000, latency=0.0, jitter=0.0, random_size=500, fixtures=None,
+                       verbose=False, modes=('serial',), workers=1, schedules=('fixed',)):
+    """End-to-end crawl of a local replay server, once per backend and mode, each in a fresh process"""
+    # Several fetch workers always run pipelined, which would make a serial run measure the pipeline
+    if workers > 1 and 'serial' in modes:
+        raise ValueError(f"{workers} workers only run pipelined, leave out the serial mode")
+    server = ReplayServer(advisors, latency, jitter, random_size, fixtures=fixtures).start()
+    reports = []
+    try:
+        for backend in backends:
+            for mode in modes:
+                for schedule in schedules:
+                    logger.info(f"Running full {mode} crawl with the {backend} backend and {schedule} schedule "
+                                f"against {server.url}")
+                    requests_before = server.requests
+                    # A fresh process per run keeps peak RSS figures apart
+                    with ProcessPoolExecutor(max_workers=1) as executor:
+                        try:
+                            report = executor.submit(run_pipeline, backend, server.url, verbose=verbose,
+                                                     pipelined=mode == 'pipelined', workers=workers,
+                                                     schedule=schedule).result()
+                        except Exception as e:
+                            report = {'backend': backend, 'pipelined': mode == 'pipelined', 'schedule': schedule,
+                                      'error': str(e)}
+                    report['server_requests'] = server.requests - requests_before
+                    reports.append(report)
+    finally:
+        server.stop()
+    return {'advisors': advisors, 'latency': latency, 'jitter': jitter, 'runs': reports}
+
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Offline DATEV scraper benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse = subparsers.add_parser('parse', help="Result page extraction and advisor parsing")
+    parse.add_argument('--fixtures', help="Directory of recorded result pages (*.html); synthetic pages if omitted")
+    parse.add_argument('--pages', type=int, default=100, help="Synthetic pages to generate (default: 100)")
+    parse.add_argument('--results-per-page', type=int, default=50, help="Entries per synthetic page (default: 50)")
+    parse.add_argument('--repeat', type=int, default=3, help="Timed repetitions (default: 3)")
+    parse.add_argument('--json', help="Also write the report to this file")
+
+    browser = subparsers.add_parser('browser', help="Selenium search latency and memory, default vs lean mode")
+    browser.add_argument('--queries', type=int, default=30, help="Timed searches per mode (default: 30)")
+    browser.add_argument('--advisors', type=int, default=2000, help="Synthetic directory size (default: 2000)")
+    browser.add_argument('--latency', type=float, default=0.0, help="Seconds the server adds to every response")
+    browser.add_argument('--modes', default='default,lean', help="Comma-separated modes (default: default,lean)")
+    browser.add_argument('--json', help="Also write the report to this file")
+
+    pipeline = subparsers.add_parser('pipeline', help="Full crawl against a local replay server")
+    pipeline.add_argument('--backends', default='http',
+                          help="Comma-separated fetch backends to compare (default: http)")
+    pipeline.add_argument('--modes', default='serial',
+                          help="Comma-separated crawl modes to compare, serial and/or pipelined (default: serial)")
+    pipeline.add_argument('--schedules', default='fixed',
+                          help="Comma-separated strategy schedules to compare, fixed and/or adaptive (default: fixed)")
+    pipeline.add_argument('--workers', type=int, default=1,
+                          help="Fetch workers of the crawl, more than one only with --modes pipelined (default: 1)")
+    pipeline.add_argument('--advisors', type=int, default=5000, help="Synthetic directory size (default: 5000)")
+    pipeline.add_argument('--latency', type=float, default=0.0, help="Seconds the server adds to every response")
+    pipeline.add_argument('--jitter', type=float, default=0.0, help="Random extra seconds per response")
+    pipeline.add_argument('--random-size', type=int, default=500,
+                          help="Results of a search without criteria (default: 500)")
+    pipeline.add_argument('--fixtures', help="Directory of recorded pages for the server to replay")
+    pipeline.add_argument('--verbose', action='store_true', help="Keep the scraper's per-search log lines")
+    pipeline.add_argument('--json', help="Also write the report to this file")
+
+    return parser.parse_args()
+
+
+def main():
+    """Run the selected benchmark and print its report"""
+    args = parse_args()
+
+    if args.command == 'parse':
+        if args.fixtures:
+            pages = load_recorded_pages(args.fixtures)
+            logger.info(f"Loaded {len(pages)} recorded pages from {args.fixtures}")
+        else:
+            pages = synthetic_result_pages(args.pages, args.results_per_page)
+            logger.info(f"Generated {len(pages)} synthetic pages of {args.results_per_page} entries")
+        report = benchmark_parse(pages, args.repeat)
+
+    elif args.command == 'browser':
+        report = benchmark_browser(args.queries, args.advisors, args.latency, args.modes.split(','))
+
+    elif args.command == 'pipeline':
+        report = benchmark_pipeline(args.backends.split(','), args.advisors, args.latency, args.jitter,
+                                    args.random_size, args.fixtures, args.verbose, args.modes.split(','),
+                                    args.workers, args.schedules.split(','))
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
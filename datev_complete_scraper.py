@@ -1,42 +1,113 @@
-import time
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+import argparse
 import logging
-import re
-import random
-from datetime import datetime
 import os
+import time
+
+from datev_export import FULL_TEXT_MODES, export_records
+from datev_fetchers import DEFAULT_BASE_URL, FETCHER_BACKENDS, RateLimiter, create_fetcher
+from datev_metrics import CrawlMetrics, MetricsServer, PhaseTimer
+from datev_planner import (INDUSTRIES, QueryPlanner, combine_criteria, postal_prefixes, refine_by_industry,
+                           refine_postal_code)
+from datev_linkage import link_records
+from datev_parser import RECORD_VERSION, extract_result_blocks, html_to_text, link_fields, parse_advisor_block
+from datev_pipeline import CrawlPipeline, ResultPages
+from datev_refresh import RefreshPlan
+from datev_scheduler import PlannedQueryFamily, QueryFamily, YieldScheduler, run_family
+from datev_storage import QueryCache, RecordStore, SearchResult, WorkQueue, stored_crawl, unit_key
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class CompleteDATEVScraper:
-    def __init__(self, headless=False):
+    def __init__(self, headless=False, backend='http', base_url=DEFAULT_BASE_URL, min_interval=2.0, jitter=2.0,
+                 page_size=50, max_pages=10, cache_path='datev_cache.sqlite', cache_ttl=7 * 24 * 3600,
+                 cache_max_bytes=500 * 1024 * 1024, state_path='datev_crawl.sqlite', resume=False,
+                 keep_full_text=True, pipelined=False, parse_workers=2, workers=1, hang_timeout=180,
+                 lean=False, profile_dir=None, schedule='fixed', min_yield=0.05, refresh_from=None,
+                 delta_path='datev_delta.csv', fresh=False):
         """Initialize the complete DATEV scraper"""
-        chrome_options = Options()
-        if headless:
-            chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36")
+        # A new crawl starts from an empty state file; one left by an earlier crawl may be its only copy, or the
+        # baseline of a later refresh, so it is only cleared when asked to
+        if not resume:
+            units, records = stored_crawl(state_path)
+            if units or records:
+                if not fresh:
+                    raise FileExistsError(f"{state_path} holds an earlier crawl ({units} searches, {records} records); "
+                                          f"continue it with --resume, or start over with --fresh")
+                logger.warning(f"Starting over: deleting {units} searches and {records} records from {state_path}")
+        
+        self.base_url = base_url
+        self.keep_full_text = keep_full_text
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.timer = PhaseTimer()
+        self.rate_limiter = RateLimiter(min_interval, jitter)
+        # One backend per fetch worker, all held to the same rate limiter; Chrome needs a profile per worker
+        self.fetchers = [create_fetcher(backend, base_url=base_url, page_size=page_size, headless=headless,
+                                        rate_limiter=self.rate_limiter, timer=self.timer, lean=lean,
+                                        profile_dir=os.path.join(profile_dir, f"worker-{i}") if profile_dir else None)
+                         for i in range(max(1, workers))]
+        self.fetcher = self.fetchers[0]
+        
+        # A refresh compares against an earlier crawl, so it has to search the site instead of the cache
+        self.refresh = None
+        self.refresh_stats = {}
+        self.delta_path = delta_path
+        if refresh_from:
+            if os.path.abspath(refresh_from) == os.path.abspath(state_path):
+                raise ValueError("A refresh needs its own state file, not the one of the crawl it refreshes")
+            self.refresh = RefreshPlan(refresh_from)
+            cache_path = None
+        
+        # Results differ per site, page settings, parser version and whether they keep full_text,
+        # so they are cached separately
+        self.cache = None
+        if cache_path:
+            self.cache = QueryCache(cache_path, ttl=cache_ttl, max_bytes=cache_max_bytes,
+                                    namespace=f"{base_url}|{page_size}|{max_pages}|{RECORD_VERSION}|"
+                                              f"{'full_text' if keep_full_text else 'no_full_text'}")
+        # Durable record of which searches are pending, running and done, and of every contact found
+        self.work_queue = WorkQueue(state_path, resume=resume)
+        self.record_store = RecordStore(state_path, resume=resume)
+        self.all_contacts = set(self.record_store.unique_ids())  # Use set to avoid duplicates
+        if resume:
+            logger.info(f"Reloaded {len(self.all_contacts)} unique contacts from {state_path}")
+        
+        # Fetch, parse, dedup and persist in separate stages instead of one after the other;
+        # several fetch workers only run in the pipeline
+        self.pipelined = pipelined or len(self.fetchers) > 1
+        self.parse_workers = parse_workers
+        self.hang_timeout = hang_timeout
+        self.pipeline = None
+        self.pipeline_stats = {}
         
-        self.driver = webdriver.Chrome(options=chrome_options)
-        self.wait = WebDriverWait(self.driver, 15)
-        self.base_url = "https://www.datev.de/kasus/Start?KammerId=BuKa&Suffix1=BuKaY&Suffix2=BuKaXY"
-        self.all_contacts = set()  # Use set to avoid duplicates
-        self.contact_data = []
+        # Run strategies in a fixed order, or let their yield decide which runs next and when to stop
+        self.schedule = schedule
+        self.min_yield = min_yield
+        self.scheduler = None
+        self.family_stats = {}
+        
+        # Per-strategy counters and phase latencies, plus live state of the other components
+        self.metrics = CrawlMetrics(self.timer)
+        self.metrics.add_source('requests', lambda: self.rate_limiter.requests)
+        self.metrics.add_source('unique_records', lambda: len(self.all_contacts))
+        self.metrics.add_source('work_units', self.work_queue.counts)
+        self.metrics.add_source('cache', lambda: self.cache.stats() if self.cache else None)
+        self.metrics.add_source('stages', lambda: self.pipeline.stats() if self.pipeline else self.pipeline_stats)
+        self.metrics.add_source('families', lambda: self.scheduler.summary() if self.scheduler else self.family_stats)
+        self.metrics.add_source('refresh', lambda: self.refresh_stats)
         
     def get_all_contacts_comprehensive(self):
         """
-        Comprehensive strategy to get all contacts using multiple approaches
+        Comprehensive strategy to get all contacts using multiple approaches;
+        returns the number of unique contacts, read them with contact_data
         """
-        logger.info(f"Starting comprehensive extraction to get all {target_count} contacts")
+        logger.info("Starting comprehensive extraction to get all contacts")
+        
+        if self.pipelined:
+            self.pipeline = CrawlPipeline(self, fetchers=self.fetchers, parse_workers=self.parse_workers,
+                                          hang_timeout=self.hang_timeout).start()
         
         strategies = [
             self._strategy_random_searches,
@@ -46,61 +117,87 @@ class CompleteDATEVScraper:
             self._strategy_postal_code_based
         ]
         
-        for i, strategy in enumerate(strategies, 1):
-            logger.info(f"Executing strategy {i}: {strategy.__name__}")
-            try:
-                strategy()
-                logger.info(f"Current unique contacts: {len(self.all_contacts)}")
-                
-                # Save progress periodically
-                if len(self.contact_data) > 0:
-                    self._save_progress()
+        try:
+            if self.schedule == 'adaptive':
+                families = []
+                for i, strategy in enumerate(strategies, 1):
+                    try:
+                        families.extend(strategy())
+                    except Exception as e:
+                        logger.error(f"Strategy {i} failed: {e}")
+                try:
+                    # A pipeline works on a whole batch at once, so give every fetch worker a few searches
+                    self.scheduler = YieldScheduler(families, self._run_units, lambda: len(self.all_contacts),
+                                                    lambda: self.rate_limiter.requests,
+                                                    batch_size=max(10, 4 * len(self.fetchers)),
+                                                    min_yield=self.min_yield)
+                    self.scheduler.run()
+                except Exception as e:
+                    logger.error(f"Adaptive schedule failed: {e}")
+                finally:
+                    # Metrics read the family yield live while the scheduler runs, and these numbers afterwards
+                    if self.scheduler:
+                        self.family_stats = self.scheduler.summary()
+                        self.scheduler = None
+                for family in families:
+                    family.log_progress()
+                self._save_progress()
+        
+            else:
+                for i, strategy in enumerate(strategies, 1):
+                    logger.info(f"Executing strategy {i}: {strategy.__name__}")
+                    try:
+                        for family in strategy():
+                            run_family(family, self._run_units)
+                            family.log_progress()
+                        logger.info(f"Current unique contacts: {len(self.all_contacts)}")
                     
-            except Exception as e:
-                logger.error(f"Strategy {i} failed: {e}")
-                continue
+                        # Save progress periodically
+                        self._save_progress()
+                        
+                    except Exception as e:
+                        logger.error(f"Strategy {i} failed: {e}")
+                        continue
+        except BaseException:
+            # On an interrupt, searches that have not started stay pending instead of being crawled first
+            if self.pipeline:
+                self.pipeline.cancel()
+            raise
+        finally:
+            # Also on an interrupt, so the stage threads and fetch workers are not left running
+            if self.pipeline:
+                self.pipeline.stop()
+                self.pipeline.log_stats()
+                self.pipeline_stats = self.pipeline.stats()
+                self.pipeline = None
+            
+            if self.refresh:
+                # Adds the records that were not searched again to the store, so exports stay complete. Also after
+                # an interrupt or error: nothing is reported gone because of searches that did not run, and their
+                # records are carried over, so the state file is still a complete baseline for the next refresh
+                self.refresh_stats = self.refresh.finish(self.work_queue.path, self.delta_path)
+                self.all_contacts = set(self.record_store.unique_ids())
         
-        return self.contact_data
+        self.timer.log_summary()
+        logger.info(f"Search units: {self.work_queue.counts()}")
+        if self.cache:
+            stats = self.cache.stats()
+            logger.info(f"Query cache: {stats['hits']} hits, {stats['misses']} misses "
+                        f"({stats['hit_rate']:.0%} hit rate), {stats['size_mb']} MB")
+        return len(self.record_store)
+    
+    @property
+    def contact_data(self):
+        """All unique contacts found so far, streamed from the record store a batch at a time"""
+        return self.record_store.records()
     
     def _strategy_random_searches(self, iterations=200):
         """Strategy 1: Multiple random searches to get different result sets"""
-        logger.info("Strategy 1: Random searches")
-        
-        for i in range(iterations):
-            try:
-                logger.info(f"Random search iteration {i+1}/{iterations}")
-                
-                # Navigate to search page
-                self.driver.get(self.base_url)
-                time.sleep(2)
-                
-                # Set to 50 results
-                try:
-                    radio_50 = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//input[@type='radio' and @value='50']")))
-                    radio_50.click()
-                except:
-                    pass
-                
-                # Click search without any criteria (random results)
-                search_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//input[@type='submit']")))
-                search_button.click()
-                time.sleep(3)
-                
-                # Extract results
-                results = self._extract_page_results()
-                self._add_unique_results(results)
-                
-                # Add random delay to avoid being blocked
-                time.sleep(random.uniform(2, 5))
-                
-            except Exception as e:
-                logger.warning(f"Random search {i+1} failed: {e}")
-                continue
+        # Search without any criteria (random results), tracked per iteration
+        return [QueryFamily('random', [({}, i) for i in range(iterations)])]
     
     def _strategy_city_based(self):
         """Strategy 2: Search by major German cities"""
-        logger.info("Strategy 2: City-based searches")
-        
         # Major German cities
         cities = [
             'Berlin', 'Hamburg', 'München', 'Köln', 'Frankfurt', 'Stuttgart', 'Düsseldorf',
@@ -118,45 +215,14 @@ class CompleteDATEVScraper:
             'Siegen', 'Hildesheim', 'Salzgitter'
         ]
         
-        for city in cities:
-            try:
-                logger.info(f"Searching city: {city}")
-                results = self._search_with_criteria({'city': city})
-                self._add_unique_results(results)
-                time.sleep(random.uniform(2, 4))
-            except Exception as e:
-                logger.warning(f"City search for {city} failed: {e}")
-                continue
+        return [QueryFamily('city', [({'city': city}, None) for city in cities])]
     
     def _strategy_industry_based(self):
         """Strategy 3: Search by industry specializations"""
-        logger.info("Strategy 3: Industry-based searches")
-        
-        # Major industries from the form
-        industries = [
-            'Einzelhandel', 'Ärzte', 'Rechtsanwälte', 'Immobilienmakler', 'Bauunternehmen - Hochbau',
-            'Gaststätten, Hotel- und Übernachtungsgewerbe', 'Handwerksbetriebe', 'Unternehmensberater',
-            'Freiberufler', 'Großhandel', 'Maschinenbau', 'Kfz-Handel', 'Banken / Kreditinstitute / Bausparkassen',
-            'Versicherungen', 'Immobilienverwalter', 'Steuerberater', 'Wirtschaftsprüfer', 'Import-/Exportunternehmen',
-            'Softwareentwicklung', 'Medien', 'Agrarwirtschaft, Land- und Forstwirte', 'Apotheken',
-            'Zahnärzte', 'Architekten', 'Ingenieure', 'Verlage', 'Fotografen', 'Bäcker / Konditor',
-            'Friseure', 'Elektrohandwerk', 'Heilberufe', 'Bildungseinrichtungen'
-        ]
-        
-        for industry in industries:
-            try:
-                logger.info(f"Searching industry: {industry}")
-                results = self._search_with_criteria({'industries': [industry]})
-                self._add_unique_results(results)
-                time.sleep(random.uniform(2, 4))
-            except Exception as e:
-                logger.warning(f"Industry search for {industry} failed: {e}")
-                continue
+        return [QueryFamily('industry', [({'industries': [industry]}, None) for industry in INDUSTRIES])]
     
     def _strategy_name_based(self):
         """Strategy 4: Search by common German surnames"""
-        logger.info("Strategy 4: Name-based searches")
-        
         # Common German surnames
         surnames = [
             'Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner',
@@ -169,110 +235,159 @@ class CompleteDATEVScraper:
             'Schubert', 'Schuster', 'Winkler', 'Berger', 'Lorenz', 'Ludwig'
         ]
         
-        for surname in surnames:
-            try:
-                logger.info(f"Searching surname: {surname}")
-                results = self._search_with_criteria({'name': surname})
-                self._add_unique_results(results)
-                time.sleep(random.uniform(2, 4))
-            except Exception as e:
-                logger.warning(f"Name search for {surname} failed: {e}")
-                continue
+        return [QueryFamily('name', [({'name': surname}, None) for surname in surnames])]
     
-    def _strategy_postal_code_based(self):
-        """Strategy 5: Search by postal code ranges"""
-        logger.info("Strategy 5: Postal code-based searches")
+    def _strategy_postal_code_based(self, industries=None):
+        """Strategy 5: Search by postal code prefixes, refining prefixes that hit the result cap"""
+        # Start from 2-digit prefixes, optionally crossed with industries
+        seeds = [{'postal_code': prefix} for prefix in postal_prefixes(2)]
+        if industries:
+            seeds = combine_criteria(seeds, [{'industries': [industry]} for industry in industries])
         
-        # German postal code ranges (first 2 digits)
-        postal_ranges = []
-        for i in range(1, 100):
-            postal_ranges.append(f"{i:02d}")
+        # One family per leading digit, so the adaptive schedule can favour the regions that still find contacts;
+        # they share the work queue name, so the searches are the same as with a single planner
+        families = []
+        for digit in sorted({seed['postal_code'][0] for seed in seeds}):
+            # A 5-digit code that is still capped gets split by industry
+            planner = QueryPlanner([seed for seed in seeds if seed['postal_code'][0] == digit],
+                                   refiners=[refine_postal_code, refine_by_industry(INDUSTRIES)],
+                                   cap=self.page_size * self.max_pages, name=f"Postal code planner {digit}")
+            
+            # Finished units replay from the work queue, so a resumed plan refines exactly as before
+            families.append(PlannedQueryFamily(f"postal_code_{digit}", planner, strategy='postal_code'))
+        return families
+    
+    def _run_units(self, strategy, units):
+        """Search (criteria, variant) units of a strategy, return SearchResults by unit key; failed units are missing"""
+        self.work_queue.enqueue(strategy, units)
+        if self.pipeline:
+            return self.pipeline.run(strategy, units)
         
-        for postal_range in postal_ranges:
+        counts = {}
+        for i, (criteria, variant) in enumerate(units, 1):
             try:
-                logger.info(f"Searching postal range: {postal_range}xxx")
-                results = self._search_with_criteria({'postal_code': postal_range})
-                self._add_unique_results(results)
-                time.sleep(random.uniform(2, 4))
+                logger.info(f"Searching {strategy} {i}/{len(units)}: {criteria or 'no criteria'}")
+                counts[unit_key(criteria, variant)] = self._search_unit(strategy, criteria, variant)
             except Exception as e:
-                logger.warning(f"Postal code search for {postal_range} failed: {e}")
+                logger.warning(f"{strategy} search for {criteria} failed: {e}")
                 continue
+        return counts
+    
+    def _finished_result(self, strategy, criteria, variant=None):
+        """SearchResult of a unit that needs no search: finished before a resume, or stable since the last refresh"""
+        result = self.work_queue.result(strategy, criteria, variant)
+        if result is None and self.refresh:
+            previous = self.refresh.skip(strategy, criteria, variant)
+            if previous:
+                self.work_queue.carry_over(strategy, criteria, variant, previous)
+                result = SearchResult(previous.result_count,
+                                      None if previous.truncated is None else bool(previous.truncated))
+        return result
     
-    def _search_with_criteria(self, criteria):
-        """Perform a single search with given criteria"""
+    def _truncated(self, criteria, pages, more_pages):
+        """Whether the site truncated a search read into ResultPages: it did not end on a page without new results,
+        and a next page was left after max_pages or a full page had no pager"""
+        if pages.read > 1:
+            logger.info(f"Read {pages.read} result pages for {criteria}: {len(pages.results)} results")
+        if pages.ended:
+            return False
+        return more_pages or (pages.read == 1 and pages.last_page_rows >= self.page_size)
+    
+    def _save_unit(self, strategy, criteria, variant, results, truncated, started, pages=None, failed=False,
+                   render_timeouts=0):
+        """Store the records of a search and mark it done or failed, return its SearchResult (None if failed);
+        pages are the fetched HTML to cache, None for results that came from the cache"""
+        if render_timeouts:
+            self.metrics.render_timeout(strategy, render_timeouts)
+        # Records are stored before the unit counts as done, so a crash in between only repeats the search
+        new_records = self._add_unique_results(results)
+        if failed:
+            # Keep what was read, the unit itself is searched again on resume
+            self.work_queue.fail(strategy, criteria, variant)
+            return None
+        
+        if self.cache and pages is not None:
+            self.cache.put(criteria, pages, results, variant, truncated=truncated)
+        self.work_queue.complete(strategy, criteria, len(results), variant, results=results, truncated=truncated)
+        self.metrics.search(strategy, time.perf_counter() - started, len(results), new_records, cached=pages is None)
+        return SearchResult(len(results), truncated)
+    
+    def _search_unit(self, strategy, criteria, variant=None):
+        """Run one search of a strategy through the work queue, return its SearchResult"""
+        result = self._finished_result(strategy, criteria, variant)
+        if result is not None:
+            return result
+        
+        self.work_queue.start(strategy, criteria, variant)
+        start = time.perf_counter()
+        cached = self.cache.get(criteria, variant) if self.cache else None
+        if cached is not None:
+            results, truncated = cached
+            return self._save_unit(strategy, criteria, variant, results, truncated, start)
+        
+        pages = ResultPages()
+        render_timeouts = self.fetcher.render_timeouts
         try:
-            # Navigate to search page
-            self.driver.get(self.base_url)
-            time.sleep(2)
-            
-            # Set to 50 results
-            try:
-                radio_50 = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//input[@type='radio' and @value='50']")))
-                radio_50.click()
-            except:
-                pass
-            
-            # Fill form with criteria
-            self._fill_search_form(criteria)
-            
-            # Submit search
-            search_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//input[@type='submit']")))
-            search_button.click()
-            time.sleep(3)
-            
-            # Extract results
-            return self._extract_page_results()
-            
+            html_pages, truncated = self._search_with_criteria(criteria, pages)
         except Exception as e:
             logger.error(f"Search failed: {e}")
-            return []
+            self.metrics.failure(strategy, e)
+            self._save_unit(strategy, criteria, variant, pages.results, None, start, failed=True,
+                            render_timeouts=self.fetcher.render_timeouts - render_timeouts)
+            raise
+        return self._save_unit(strategy, criteria, variant, pages.results, truncated, start, pages=html_pages,
+                               render_timeouts=self.fetcher.render_timeouts - render_timeouts)
     
-    def _fill_search_form(self, criteria):
-        """Fill the search form with provided criteria"""
-        try:
-            # Name field
-            if criteria.get('name'):
-                name_field = self.driver.find_element(By.NAME, "Name")
-                name_field.clear()
-                name_field.send_keys(criteria['name'])
+    def _search_with_criteria(self, criteria, pages):
+        """Perform a single search with given criteria, reading result pages up to max_pages into pages;
+        return the HTML of the pages and whether the site truncated the results"""
+        html_pages = []
+        for html in self.fetcher.fetch_pages(criteria, self.max_pages):
+            html_pages.append(html)
             
-            # City field
-            if criteria.get('city'):
-                city_field = self.driver.find_element(By.NAME, "Ort")
-                city_field.clear()
-                city_field.send_keys(criteria['city'])
+            # Extract results
+            with self.timer.span('extract'):
+                page_results = self._extract_page_results(html)
             
-            # Postal code field  
-            if criteria.get('postal_code'):
-                postal_field = self.driver.find_element(By.NAME, "Postleitzahl")
-                postal_field.clear()
-                postal_field.send_keys(criteria['postal_code'])
+            # Stop on an empty page or when the site serves the same page again
+            if not pages.add(page_results):
+                break
+        
+        more_pages = pages.read == self.max_pages and not pages.ended and self.fetcher.has_next_page()
+        return html_pages, self._truncated(criteria, pages, more_pages)
+    
+    def _extract_page_results(self, html):
+        """Extract results from a result page, one block per result entry of the page structure"""
+        results = []
+        
+        try:
+            blocks = extract_result_blocks(html)
+            if not blocks:
+                return self._extract_text_results(html)
             
-            # Industry checkboxes
-            if criteria.get('industries'):
-                for industry in criteria['industries']:
-                    try:
-                        industry_checkbox = self.driver.find_element(
-                            By.XPATH, f"//input[@type='checkbox' and @value='{industry}']"
-                        )
-                        if not industry_checkbox.is_selected():
-                            industry_checkbox.click()
-                    except NoSuchElementException:
-                        continue
-                        
+            # Part of the extract phase: fields from the blocks of the page
+            with self.timer.span('parse'):
+                for block in blocks:
+                    advisor_data = self._parse_advisor_block(block.lines)
+                    if advisor_data:
+                        # Email, phone and website may only be present as links
+                        for field, value in link_fields(block.links).items():
+                            if not advisor_data[field]:
+                                advisor_data[field] = value
+                        results.append(advisor_data)
+                    
         except Exception as e:
-            logger.warning(f"Error filling form: {e}")
+            logger.error(f"Error extracting results: {e}")
+            
+        return results
     
-    def _extract_page_results(self):
-        """Extract results from current page"""
+    def _extract_text_results(self, html):
+        """Fallback: extract results from the page text by guessing where each entry starts"""
         results = []
         
         try:
-            # Wait for page to load
-            time.sleep(3)
-            
             # Get page text and parse advisor blocks
-            body_text = self.driver.find_element(By.TAG_NAME, "body").text
+            body_text = html_to_text(html)
             
             # Split by advisor entries (look for patterns)
             advisor_blocks = []
@@ -312,132 +427,146 @@ class CompleteDATEVScraper:
             
         return results
     
-    def _parse_advisor_block(self, block_text):
-        """Parse individual advisor text block into structured data"""
+    def _parse_advisor_block(self, block):
+        """Parse individual advisor block (text or lines) into structured data"""
         try:
-            lines = [line.strip() for line in block_text.split('\n') if line.strip()]
-            
-            if len(lines) < 3:
-                return None
-            
-            advisor_data = {
-                'title': '',
-                'name': '',
-                'profession': '',
-                'company': '',
-                'address': '',
-                'city': '',
-                'postal_code': '',
-                'phone': '',
-                'fax': '',
-                'mobile': '',
-                'email': '',
-                'website': '',
-                'chamber': '',
-                'unique_id': '',  # For deduplication
-                'full_text': block_text
-            }
-            
-            for i, line in enumerate(lines):
-                # Title detection
-                if line.startswith(('Herrn', 'Frau')) and not advisor_data['title']:
-                    advisor_data['title'] = line
-                
-                # Profession detection
-                elif any(prof in line for prof in ['Steuerberater', 'Steuerbevollmächtigte', 'Wirtschaftsprüfer']):
-                    advisor_data['profession'] = line
-                    # Previous line might be name if not company
-                    if i > 0 and not any(suffix in lines[i-1] for suffix in ['GmbH', 'mbH', 'AG']):
-                        advisor_data['name'] = lines[i-1]
-                
-                # Company name
-                elif any(suffix in line for suffix in ['GmbH', 'mbH', 'AG', 'Partnerschaft', 'PartG']):
-                    advisor_data['company'] = line
-                
-                # Address
-                elif re.match(r'^[A-Za-zäöüÄÖÜß\s\-\.]+\s+\d+', line):
-                    advisor_data['address'] = line
-                
-                # Postal code and city
-                elif re.match(r'^\d{5}\s+[A-Za-zäöüÄÖÜß\s\-]+', line):
-                    parts = line.split(' ', 1)
-                    advisor_data['postal_code'] = parts[0]
-                    if len(parts) > 1:
-                        advisor_data['city'] = parts[1]
-                
-                # Contact info
-                elif line.startswith('Tel.:'):
-                    advisor_data['phone'] = line.replace('Tel.:', '').strip()
-                elif line.startswith('Fax:'):
-                    advisor_data['fax'] = line.replace('Fax:', '').strip()
-                elif line.startswith('Mobil:'):
-                    advisor_data['mobile'] = line.replace('Mobil:', '').strip()
-                elif line.startswith('Email:'):
-                    advisor_data['email'] = line.replace('Email:', '').strip()
-                elif line.startswith('Internet:'):
-                    advisor_data['website'] = line.replace('Internet:', '').strip()
-                elif 'Steuerberaterkammer' in line:
-                    advisor_data['chamber'] = line.replace('Zuständige Berufskammer:', '').strip()
-            
-            # Create unique ID for deduplication
-            name_part = advisor_data.get('name', advisor_data.get('company', ''))
-            address_part = advisor_data.get('address', '')
-            advisor_data['unique_id'] = f"{name_part}_{address_part}".replace(' ', '_').lower()
-            
-            return advisor_data if name_part else None
+            record = parse_advisor_block(block, self.keep_full_text)
+            return record.to_dict() if record else None
             
         except Exception as e:
             logger.warning(f"Error parsing block: {e}")
             return None
     
     def _add_unique_results(self, results):
-        """Add results to collection, avoiding duplicates"""
+        """Store results, merging ones seen before into the stored record; return how many were new"""
+        identified = []
+        new_results = 0
         for result in results:
             unique_id = result.get('unique_id', '')
-            if unique_id and unique_id not in self.all_contacts:
-                self.all_contacts.add(unique_id)
-                self.contact_data.append(result)
+            if unique_id:
+                identified.append(result)
+                if unique_id not in self.all_contacts:
+                    self.all_contacts.add(unique_id)
+                    new_results += 1
+        
+        if identified:
+            with self.timer.span('save'):
+                self.record_store.add(identified)
+        return new_results
     
     def _save_progress(self):
-        """Save current progress to file"""
-        if self.contact_data:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f'datev_progress_{timestamp}.xlsx'
-            
-            df = pd.DataFrame(self.contact_data)
-            df = df.drop_duplicates(subset=['unique_id'], keep='first')
-            df.to_excel(filename, index=False)
-            
-            logger.info(f"Progress saved: {len(df)} unique contacts in {filename}")
+        """Checkpoint the record store; records are already on disk, so this only covers new ones"""
+        new_records = self.record_store.checkpoint()
+        logger.info(f"Progress saved: {new_records} new, {len(self.all_contacts)} unique contacts "
+                    f"in {self.record_store.path}")
     
-    def save_final_results(self, filename='datev_all_contacts_final.xlsx'):
-        """Save final results to Excel"""
-        if not self.contact_data:
+    def save_final_results(self, filename='datev_all_contacts_final.xlsx', full_text='keep', link=True):
+        """Export final results to XLSX, CSV or Parquet, streamed from the record store"""
+        if not self.all_contacts:
             logger.warning("No data to save")
             return
         
-        df = pd.DataFrame(self.contact_data)
-        df = df.drop_duplicates(subset=['unique_id'], keep='first')
+        # Unique IDs only catch exact duplicates; linkage merges entries that differ in spelling
+        records = link_records(self.record_store.records) if link else self.record_store.records()
+        stats = export_records(records, filename, full_text=full_text)
+        logger.info(f"Final results saved: {stats['rows']} unique contacts in {filename}")
         
-        # Clean and organize columns
-        column_order = ['name', 'title', 'profession', 'company', 'address', 'postal_code', 'city', 
-                       'phone', 'fax', 'mobile', 'email', 'website', 'chamber']
-        
-        existing_columns = [col for col in column_order if col in df.columns]
-        df_final = df[existing_columns + ['full_text']]
-        
-        df_final.to_excel(filename, index=False)
-        logger.info(f"Final results saved: {len(df_final)} unique contacts in {filename}")
-        
-        return len(df_final)
+        return stats['rows']
     
     def close(self):
-        """Close the browser"""
-        self.driver.quit()
+        """Close the search backends, the crawl state and the cache"""
+        for fetcher in self.fetchers:
+            fetcher.close()
+        self.work_queue.close()
+        self.record_store.close()
+        if self.cache:
+            self.cache.close()
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Extract all DATEV tax advisor contacts")
+    parser.add_argument('--backend', choices=sorted(FETCHER_BACKENDS), default='http',
+                        help="How searches are fetched (default: http)")
+    parser.add_argument('--headless', action='store_true', help="Run Chrome headless (selenium backend)")
+    parser.add_argument('--lean', action='store_true',
+                        help="Selenium without images, fonts and CSS, reusing the loaded search form")
+    parser.add_argument('--profile-dir',
+                        help="Chrome profile kept between runs (default with --lean: datev_chrome_profile)")
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL, help="kasus start page to search from")
+    parser.add_argument('--max-pages', type=int, default=10,
+                        help="Result pages to follow per search (default: 10)")
+    parser.add_argument('--cache', default='datev_cache.sqlite',
+                        help="SQLite file caching search results between runs (default: datev_cache.sqlite)")
+    parser.add_argument('--no-cache', action='store_true', help="Always search the site, ignore the cache")
+    parser.add_argument('--cache-ttl-hours', type=float, default=168,
+                        help="Hours before a cached search is repeated (default: 168)")
+    parser.add_argument('--cache-max-mb', type=float, default=500,
+                        help="Cache size before least recently used searches are evicted (default: 500)")
+    parser.add_argument('--output', default='datev_all_27k_contacts.xlsx',
+                        help="Result file, .xlsx, .csv, .csv.gz or .parquet (default: datev_all_27k_contacts.xlsx)")
+    parser.add_argument('--full-text', choices=FULL_TEXT_MODES, default='keep',
+                        help="Keep, drop or compress the raw full_text column in the export (default: keep)")
+    parser.add_argument('--no-linkage', action='store_true',
+                        help="Export every stored record instead of merging near-duplicates")
+    parser.add_argument('--state', default='datev_crawl.sqlite',
+                        help="SQLite file tracking the searches of this crawl (default: datev_crawl.sqlite)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue the crawl recorded in --state instead of starting over")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Start over even if --state holds an earlier crawl, deleting it")
+    parser.add_argument('--refresh', metavar='PREVIOUS_STATE',
+                        help="Refresh the crawl recorded in this state file: skip searches whose results stayed "
+                             "the same and write what changed to --delta")
+    parser.add_argument('--delta', default='datev_delta.csv',
+                        help="Change feed of a --refresh: added, changed and disappeared contacts "
+                             "(default: datev_delta.csv)")
+    parser.add_argument('--report', default='datev_run_report.json',
+                        help="JSON file for the run report: phase latencies, per-strategy searches, failures "
+                             "and yield, throughput and memory (default: datev_run_report.json)")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="Serve live metrics on http://127.0.0.1:PORT/metrics (Prometheus) and "
+                             "/metrics.json while the crawl runs (default: off)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Fetch, parse and store in separate stages so requests never wait on parsing")
+    parser.add_argument('--parse-workers', type=int, default=2,
+                        help="Parser threads of the --pipeline mode (default: 2)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Fetch workers (browsers with --backend selenium) searching in parallel; "
+                             "more than one implies --pipeline (default: 1)")
+    parser.add_argument('--hang-timeout', type=float, default=180,
+                        help="Seconds without progress before a fetch worker is restarted (default: 180)")
+    parser.add_argument('--schedule', choices=['fixed', 'adaptive'], default='fixed',
+                        help="Run strategies in order, or by how many new contacts they still find (default: fixed)")
+    parser.add_argument('--min-yield', type=float, default=0.05,
+                        help="Adaptive schedule: new contacts per request below which a strategy is dropped "
+                             "(default: 0.05)")
+    parser.add_argument('--min-interval', type=float, default=2.0,
+                        help="Minimum seconds between requests to the server, across all workers (default: 2.0)")
+    parser.add_argument('--jitter', type=float, default=2.0,
+                        help="Random extra seconds added to each request interval (default: 2.0)")
+    return parser.parse_args()
 
 def main():
     """Main function to extract all DATEV contacts"""
-    scraper = CompleteDATEVScraper(headless=False)
+    args = parse_args()
+    try:
+        scraper = CompleteDATEVScraper(headless=args.headless, backend=args.backend, base_url=args.base_url,
+                                       min_interval=args.min_interval, jitter=args.jitter, max_pages=args.max_pages,
+                                       cache_path=None if args.no_cache else args.cache,
+                                       cache_ttl=args.cache_ttl_hours * 3600,
+                                       cache_max_bytes=int(args.cache_max_mb * 1024 * 1024),
+                                       state_path=args.state, resume=args.resume,
+                                       keep_full_text=args.full_text != 'drop', pipelined=args.pipeline,
+                                       parse_workers=args.parse_workers, workers=args.workers,
+                                       hang_timeout=args.hang_timeout, lean=args.lean,
+                                       profile_dir=args.profile_dir or ('datev_chrome_profile' if args.lean else None),
+                                       schedule=args.schedule, min_yield=args.min_yield, refresh_from=args.refresh,
+                                       delta_path=args.delta, fresh=args.fresh)
+    except (FileExistsError, FileNotFoundError, ValueError) as e:
+        logger.error(e)
+        return
+    
+    metrics_server = MetricsServer(scraper.metrics, port=args.metrics_port).start() if args.metrics_port else None
     
     try:
         logger.info("Starting comprehensive DATEV contact extraction")
@@ -447,24 +576,28 @@ def main():
         scraper.get_all_contacts_comprehensive()
         
         # Save final results
-        final_count = scraper.save_final_results('datev_all_27k_contacts.xlsx')
+        final_count = scraper.save_final_results(args.output, full_text=args.full_text, link=not args.no_linkage)
         
         print(f"\n{'='*60}")
         print(f"EXTRACTION COMPLETED!")
         print(f"Total unique contacts extracted: {final_count}")
         print(f"All available contacts extracted.")
-        print(f"Results saved to: datev_all_contacts.xlsx")
+        print(f"Results saved to: {args.output}")
         print(f"{'='*60}")
         
     except KeyboardInterrupt:
         logger.info("Extraction interrupted by user")
-        scraper.save_final_results('datev_partial_contacts.xlsx')
+        scraper.save_final_results('datev_partial_contacts.xlsx', full_text=args.full_text, link=not args.no_linkage)
         
     except Exception as e:
         logger.error(f"Extraction failed: {e}")
-        scraper.save_final_results('datev_error_recovery.xlsx')
+        scraper.save_final_results('datev_error_recovery.xlsx', full_text=args.full_text, link=not args.no_linkage)
         
     finally:
+        if args.report:
+            scraper.metrics.write_report(args.report)
+        if metrics_server:
+            metrics_server.stop()
         scraper.close()
 
 if __name__ == "__main__":
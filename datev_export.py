@@ -0,0 +1,149 @@
+import os
+import csv
+import gzip
+import time
+import zlib
+import base64
+import logging
+from itertools import islice
+
+from openpyxl import Workbook
+
+logger = logging.getLogger(__name__)
+
+# Column order of exported contacts
+EXPORT_COLUMNS = ['name', 'title', 'profession', 'company', 'address', 'postal_code', 'city',
+                  'phone', 'fax', 'mobile', 'email', 'website', 'chamber']
+
+EXPORT_FORMATS = ('csv', 'parquet', 'xlsx')
+
+# What to do with the bulky full_text column
+FULL_TEXT_MODES = ('keep', 'drop', 'compress')
+
+
+def export_format(filename):
+    """Export format implied by a file name, e.g. contacts.csv.gz -> csv"""
+    name = filename.lower()
+    gzipped = name.endswith('.gz')
+    if gzipped:
+        name = name[:-3]
+    extension = os.path.splitext(name)[1].lstrip('.')
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(f"Cannot export to '{filename}', use one of: {', '.join(EXPORT_FORMATS)}")
+    # XLSX and Parquet are compressed already and are written as they are
+    if gzipped and extension != 'csv':
+        raise ValueError(f"Cannot export to '{filename}', only CSV can be gzipped")
+    return extension
+
+
+def compress_text(text):
+    """zlib-compress text into a base64 string that fits in a CSV or Excel cell"""
+    return base64.b64encode(zlib.compress(text.encode('utf-8'), 9)).decode('ascii')
+
+
+def decompress_text(value):
+    """Inverse of compress_text"""
+    return zlib.decompress(base64.b64decode(value)).decode('utf-8')
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _rows(records, columns, full_text):
+    """Turn record dicts into value lists in column order"""
+    for record in records:
+        row = [record.get(column, '') for column in columns]
+        if full_text == 'keep':
+            row.append(record.get('full_text', ''))
+        elif full_text == 'compress':
+            row.append(compress_text(record.get('full_text', '')))
+        yield row
+
+
+def _write_csv(filename, header, row_chunks):
+    opener = gzip.open if filename.lower().endswith('.gz') else open
+    with opener(filename, 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for chunk in row_chunks:
+            writer.writerows(chunk)
+
+
+def _write_xlsx(filename, header, row_chunks):
+    # Write-only mode streams rows to disk instead of keeping the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('contacts')
+    sheet.append(header)
+    for chunk in row_chunks:
+        for row in chunk:
+            sheet.append(row)
+    workbook.save(filename)
+
+
+def _write_parquet(filename, header, row_chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+
+    schema = pa.schema([(column, pa.string()) for column in header])
+    with pq.ParquetWriter(filename, schema, compression='zstd') as writer:
+        for chunk in row_chunks:
+            columns = [[row[i] for row in chunk] for i in range(len(header))]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+
+WRITERS = {
+    'csv': _write_csv,
+    'parquet': _write_parquet,
+    'xlsx': _write_xlsx,
+}
+
+
+def export_records(records, filename, full_text='keep', chunk_size=5000, columns=EXPORT_COLUMNS):
+    """
+    Stream records to CSV, Parquet or XLSX, chosen by file extension.
+
+    Records are consumed chunk_size at a time, so memory stays flat however
+    many there are. full_text is kept as is, dropped, or zlib-compressed and
+    base64-encoded. Returns the number of rows and the export throughput.
+    """
+    if full_text not in FULL_TEXT_MODES:
+        raise ValueError(f"Unknown full_text mode '{full_text}', use one of: {', '.join(FULL_TEXT_MODES)}")
+
+    fmt = export_format(filename)
+    header = list(columns)
+    if full_text == 'keep':
+        header.append('full_text')
+    elif full_text == 'compress':
+        header.append('full_text_zlib')
+
+    row_count = 0
+
+    def counted(chunks):
+        nonlocal row_count
+        for chunk in chunks:
+            row_count += len(chunk)
+            yield chunk
+
+    start = time.perf_counter()
+    WRITERS[fmt](filename, header, counted(_chunks(_rows(records, columns, full_text), chunk_size)))
+    seconds = time.perf_counter() - start
+
+    size = os.path.getsize(filename)
+    stats = {
+        'rows': row_count,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(row_count / seconds, 1) if seconds else 0.0,
+        'mb': round(size / 1024 / 1024, 2),
+    }
+    logger.info(f"Exported {row_count} rows to {filename} in {seconds:.1f}s "
+                f"({stats['rows_per_sec']:.0f} rows/s, {stats['mb']} MB)")
+    return stats
@@ -0,0 +1,638 @@
+import os
+import re
+import glob
+import time
+import random
+import logging
+import threading
+from collections import namedtuple
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
+
+from datev_metrics import PhaseTimer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://www.datev.de/kasus/Start?KammerId=BuKa&Suffix1=BuKaY&Suffix2=BuKaXY"
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+
+# Search criteria keys mapped to the kasus form field names
+FORM_FIELDS = {
+    'name': 'Name',
+    'city': 'Ort',
+    'postal_code': 'Postleitzahl',
+}
+
+# Page elements the Selenium backend waits for instead of sleeping
+SUBMIT_LOCATOR = (By.XPATH, "//input[@type='submit']")
+# A result container holding an advisor entry; the form's own industry labels mention professions too
+RESULTS_LOCATOR = (By.XPATH, "//*[contains(@class, 'result') or contains(@class, 'treffer') or "
+                             "contains(@class, 'ergebnis')][.//text()[contains(., 'Steuerberater') or "
+                             "contains(., 'Steuerbevollmächtigte') or contains(., 'Wirtschaftsprüfer')]]")
+# Fallback for result containers with other class names: an element outside the search form naming a profession
+PROFESSION_LOCATOR = (By.XPATH, "//*[not(ancestor-or-self::form) and not(self::script or self::title)]"
+                                "[text()[contains(., 'Steuerberater') or contains(., 'Steuerbevollmächtigte') or "
+                                "contains(., 'Wirtschaftsprüfer')]]")
+NO_RESULTS_LOCATOR = (By.XPATH, "//*[contains(text(), 'keine Treffer') or contains(text(), 'Keine Treffer') or "
+                                "contains(text(), 'keine Ergebnisse') or contains(text(), 'Keine Ergebnisse') or "
+                                "contains(text(), 'nicht gefunden')]")
+
+# Resources the lean Selenium mode never downloads
+BLOCKED_RESOURCES = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+                     '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.css']
+
+# Clears the search form's text fields and industry checkboxes in one round trip
+RESET_FORM_SCRIPT = (
+    "for (const name of arguments[0]) { for (const field of document.getElementsByName(name)) field.value = ''; }"
+    "document.querySelectorAll('input[type=checkbox]:checked').forEach(box => { box.checked = false; });"
+)
+
+# Link or button captions of the result list's "next page" control
+NEXT_PAGE_LABELS = {'weiter', 'nächste', 'nächste seite', 'vorwärts', 'next'}
+NEXT_PAGE_SYMBOLS = {'>', '>>', '»', '›'}
+
+# How to get to the next result page: a link to follow or a form button to submit
+NextPage = namedtuple('NextPage', ['method', 'url', 'payload', 'submit'])
+
+
+class RateLimiter:
+    """Space out requests to the server; one instance is shared by everything that talks to it"""
+
+    def __init__(self, min_interval=2.0, jitter=2.0):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self.requests = 0  # requests let through so far
+
+    def wait(self):
+        """Block until the next request may be sent, return the seconds waited"""
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval + random.uniform(0, self.jitter)
+
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class SearchFetcher:
+    """Base class for search backends: takes a criteria dict, returns result page HTML"""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, page_size=50, rate_limiter=None, timer=None):
+        self.base_url = base_url
+        self.page_size = page_size
+        self.rate_limiter = rate_limiter
+        self.timer = timer or PhaseTimer()
+        self.render_timeouts = 0  # result pages that did not render in time, the search went on regardless
+
+    def _throttle(self):
+        """Wait for the shared rate limiter before sending a request"""
+        if self.rate_limiter is not None:
+            with self.timer.span('throttle'):
+                self.rate_limiter.wait()
+
+    def fetch(self, criteria):
+        """Submit one search and return the raw HTML of the result page"""
+        raise NotImplementedError
+
+    def next_page(self):
+        """HTML of the next page of the current result list, or None at the end"""
+        return None
+
+    def has_next_page(self):
+        """Whether the current result page offers a next page, without loading it"""
+        return False
+
+    def fetch_pages(self, criteria, max_pages=1):
+        """Yield the HTML of each result page of one search, following next-page links"""
+        yield self.fetch(criteria)
+        for _ in range(max_pages - 1):
+            html = self.next_page()
+            if html is None:
+                return
+            yield html
+
+    def restart(self):
+        """Drop the backend's session or browser so the next search starts from scratch"""
+        self.close()
+
+    def abort(self):
+        """Called from another thread when a search hangs, to make the blocked call fail"""
+        self.close()
+
+    def close(self):
+        """Release any resources held by the backend"""
+        pass
+
+
+class SearchForm:
+    """Fields and target of the kasus search form as found on the start page"""
+
+    def __init__(self, action, method='post'):
+        self.action = action
+        self.method = method
+        self.fields = []  # (name, value) pairs a browser would submit by default
+        self.text_fields = set()
+        self.checkboxes = {}  # checkbox value -> field name
+        self.radios = {}  # (field name, value) of every radio button
+        self.submits = []  # (name, value) of every submit button
+
+    def page_size_field(self, page_size):
+        """Name of the radio button group that selects the given page size"""
+        for name, value in self.radios:
+            if value == str(page_size):
+                return name
+        return None
+
+    @property
+    def submit(self):
+        """The button a plain form submission uses"""
+        return self.submits[0] if self.submits else None
+
+
+class _PageParser(HTMLParser):
+    """Collect the forms of a page with their input controls, and its links"""
+
+    def __init__(self, page_url):
+        super().__init__(convert_charrefs=True)
+        self.page_url = page_url
+        self.forms = []
+        self.links = []  # (href, caption, rel)
+        self._form = None
+        self._select = None
+        self._link = None
+
+    def handle_data(self, data):
+        if self._link is not None:
+            self._link[1] += data
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {key: value if value is not None else '' for key, value in attrs}
+
+        if tag == 'a' and attrs.get('href'):
+            self._link = [urljoin(self.page_url, attrs['href']), '', attrs.get('rel', ''), attrs.get('title', '')]
+            return
+
+        if tag == 'form':
+            action = urljoin(self.page_url, attrs.get('action') or self.page_url)
+            self._form = SearchForm(action, (attrs.get('method') or 'post').lower())
+            self.forms.append(self._form)
+            return
+
+        if self._form is None:
+            return
+
+        name = attrs.get('name')
+        if tag == 'input' and name:
+            input_type = (attrs.get('type') or 'text').lower()
+            value = attrs.get('value', '')
+
+            if input_type == 'checkbox':
+                self._form.checkboxes[value] = name
+                if 'checked' in attrs:
+                    self._form.fields.append((name, value))
+            elif input_type == 'radio':
+                self._form.radios[(name, value)] = 'checked' in attrs
+                if 'checked' in attrs:
+                    self._form.fields.append((name, value))
+            elif input_type in ('submit', 'image'):
+                self._form.submits.append((name, value))
+            elif input_type not in ('button', 'reset', 'file'):
+                self._form.fields.append((name, value))
+                if input_type != 'hidden':
+                    self._form.text_fields.add(name)
+
+        elif tag == 'select' and name:
+            self._select = [name, None]
+        elif tag == 'option' and self._select is not None:
+            value = attrs.get('value', '')
+            if self._select[1] is None or 'selected' in attrs:
+                self._select[1] = value
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._link is not None:
+            href, text, rel, title = self._link
+            self.links.append((href, text.strip() or title, rel))
+            self._link = None
+        elif tag == 'select' and self._select is not None:
+            if self._form is not None and self._select[1] is not None:
+                self._form.fields.append(tuple(self._select))
+            self._select = None
+        elif tag == 'form':
+            self._form = None
+
+
+def _parse_page(html, page_url):
+    parser = _PageParser(page_url)
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def parse_search_form(html, page_url):
+    """Find the advisor search form on the start page"""
+    parser = _parse_page(html, page_url)
+
+    for form in parser.forms:
+        if FORM_FIELDS['name'] in form.text_fields:
+            return form
+    if parser.forms:
+        return parser.forms[0]
+    raise ValueError(f"No search form found on {page_url}")
+
+
+def _css_string(value):
+    """Quoted CSS string for an attribute selector, safe for any quotes or backslashes in the value"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\a ') + '"'
+
+
+def is_next_page_label(caption):
+    """Whether a link or button caption means 'next page'"""
+    caption = (caption or '').strip()
+    if caption in NEXT_PAGE_SYMBOLS:
+        return True
+    words = ' '.join(re.findall(r'\w+', caption.casefold()))
+    return words in NEXT_PAGE_LABELS
+
+
+def find_next_page(html, page_url):
+    """Locate the next-page control of a result list, None on the last page"""
+    parser = _parse_page(html, page_url)
+
+    for href, caption, rel in parser.links:
+        if 'next' in rel.split() or is_next_page_label(caption):
+            return NextPage('get', href, None, None)
+
+    for form in parser.forms:
+        for name, value in form.submits:
+            if is_next_page_label(value):
+                return NextPage(form.method, form.action, form.fields + [(name, value)], (name, value))
+
+    return None
+
+
+class HttpSearchFetcher(SearchFetcher):
+    """Post the search form directly over a pooled HTTP session, no browser involved"""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, page_size=50, rate_limiter=None, timer=None,
+                 timeout=30, pool_size=4, user_agent=DEFAULT_USER_AGENT):
+        super().__init__(base_url, page_size, rate_limiter, timer)
+        self.timeout = timeout
+
+        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                        allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = user_agent
+        self.form = None
+        self._page = None  # (html, url) of the last result page
+
+    def _load_form(self):
+        """Open the start page to get session cookies and the current form layout"""
+        self._throttle()
+        with self.timer.span('navigate'):
+            response = self.session.get(self.base_url, timeout=self.timeout)
+            response.raise_for_status()
+            self.form = parse_search_form(response.text, response.url)
+        return self.form
+
+    def build_payload(self, criteria):
+        """Turn search criteria into the form fields a browser would submit"""
+        form = self.form or self._load_form()
+        overrides = {FORM_FIELDS[key]: value for key, value in criteria.items()
+                     if key in FORM_FIELDS and value}
+
+        page_size_field = form.page_size_field(self.page_size)
+
+        payload = []
+        for name, value in form.fields:
+            if name in overrides or name == page_size_field:
+                continue
+            payload.append((name, value))
+
+        payload.extend(overrides.items())
+        if page_size_field:
+            payload.append((page_size_field, str(self.page_size)))
+
+        for industry in criteria.get('industries') or []:
+            field_name = form.checkboxes.get(industry)
+            if field_name is None:
+                logger.debug(f"Unknown industry checkbox: {industry}")
+                continue
+            if (field_name, industry) not in payload:
+                payload.append((field_name, industry))
+
+        if form.submit:
+            payload.append(form.submit)
+
+        return payload
+
+    def fetch(self, criteria):
+        """Submit one search and return the raw HTML of the result page"""
+        for attempt in range(2):
+            form = self.form or self._load_form()
+            with self.timer.span('fill'):
+                payload = self.build_payload(criteria)
+
+            self._throttle()
+            try:
+                with self.timer.span('submit'):
+                    if form.method == 'get':
+                        response = self.session.get(form.action, params=payload, timeout=self.timeout)
+                    else:
+                        response = self.session.post(form.action, data=payload, timeout=self.timeout)
+                    response.raise_for_status()
+                self._page = (response.text, response.url)
+                return response.text
+            except requests.RequestException as e:
+                if attempt:
+                    raise
+                # The session may have expired, start over from the start page
+                logger.warning(f"Search request failed, reloading search form: {e}")
+                self.form = None
+
+    def next_page(self):
+        """HTML of the next page of the current result list, or None at the end"""
+        if self._page is None:
+            return None
+
+        next_page = find_next_page(*self._page)
+        if next_page is None:
+            return None
+
+        self._throttle()
+        with self.timer.span('paginate'):
+            if next_page.method == 'get':
+                response = self.session.get(next_page.url, params=next_page.payload, timeout=self.timeout)
+            else:
+                response = self.session.post(next_page.url, data=next_page.payload, timeout=self.timeout)
+            response.raise_for_status()
+
+        self._page = (response.text, response.url)
+        return response.text
+
+    def has_next_page(self):
+        return self._page is not None and find_next_page(*self._page) is not None
+
+    def restart(self):
+        """Reconnect and reload the search form with the next search"""
+        self.session.close()
+        self.form = None
+        self._page = None
+
+    def close(self):
+        """Close the pooled HTTP session"""
+        self.session.close()
+
+
+def _parsed_with(locator):
+    """Wait condition: the document has been parsed and locator finds an element in it"""
+    def condition(driver):
+        return (driver.execute_script("return document.readyState") != 'loading'
+                and EC.presence_of_element_located(locator)(driver))
+    return condition
+
+
+class SeleniumSearchFetcher(SearchFetcher):
+    """
+    Drive a real Chrome through the search form, for when plain HTTP is not enough.
+
+    In lean mode Chrome skips images, fonts and stylesheets, returns from
+    navigation once the DOM is ready ("eager") and goes back to the search
+    form in its history and resets it instead of loading the start page for
+    every search. profile_dir keeps Chrome's cache between runs and restarts.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, page_size=50, rate_limiter=None, timer=None,
+                 headless=False, user_agent=DEFAULT_USER_AGENT, page_load_timeout=60, lean=False, profile_dir=None):
+        super().__init__(base_url, page_size, rate_limiter, timer)
+
+        self.headless = headless
+        self.user_agent = user_agent
+        self.page_load_timeout = page_load_timeout
+        self.lean = lean
+        self.profile_dir = profile_dir
+        self._driver = None
+        self.wait = None
+        self._form_url = None  # where the search form was loaded
+        self._history = 0  # pages opened since then
+
+    @property
+    def driver(self):
+        """Chrome is only started once the first search actually needs it"""
+        if self._driver is None:
+            chrome_options = Options()
+            if self.headless:
+                chrome_options.add_argument("--headless")
+            chrome_options.add_argument("--no-sandbox")
+            chrome_options.add_argument("--disable-dev-shm-usage")
+            chrome_options.add_argument(f"--user-agent={self.user_agent}")
+            if self.profile_dir:
+                self._unlock_profile()
+                chrome_options.add_argument(f"--user-data-dir={os.path.abspath(self.profile_dir)}")
+            if self.lean:
+                chrome_options.page_load_strategy = 'eager'
+                chrome_options.add_experimental_option('prefs', {
+                    'profile.managed_default_content_settings.images': 2,
+                    'profile.managed_default_content_settings.fonts': 2,
+                })
+
+            self._driver = webdriver.Chrome(options=chrome_options)
+            # A page that never finishes loading raises instead of blocking the worker
+            self._driver.set_page_load_timeout(self.page_load_timeout)
+            if self.lean:
+                self._driver.execute_cdp_cmd('Network.enable', {})
+                self._driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_RESOURCES})
+            self.wait = WebDriverWait(self._driver, 15)
+            self._form_url = None
+            self._history = 0
+        return self._driver
+
+    def _unlock_profile(self):
+        """Remove the lock a killed Chrome leaves in its profile; each worker has its own profile"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(self.profile_dir, 'Singleton*')):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove stale profile lock {path}: {e}")
+
+    def fetch(self, criteria):
+        """Submit one search and return the raw HTML of the result page"""
+        # Navigate to search page and wait until the form is usable
+        search_button = self._reuse_form() if self.lean else None
+        if search_button is None:
+            self._throttle()
+            with self.timer.span('navigate'):
+                self.driver.get(self.base_url)
+                search_button = self.wait.until(EC.element_to_be_clickable(SUBMIT_LOCATOR))
+            self._form_url = self.driver.current_url
+
+        # Set page size and fill form with criteria
+        with self.timer.span('fill'):
+            self._select_page_size()
+            self._fill_search_form(criteria)
+
+        # Submit search and wait for the form page to go away
+        with self.timer.span('submit'):
+            search_button.click()
+            self.wait.until(EC.staleness_of(search_button))
+        self._history = 1
+
+        self._wait_for_results()
+        return self.driver.page_source
+
+    def _reuse_form(self):
+        """Lean mode: go back to the search form loaded earlier and reset it, None if that fails"""
+        if self._driver is None or self._form_url is None or not self._history:
+            return None
+
+        # Usually restored from Chrome's back/forward cache, but that is not guaranteed, so it counts as a request
+        self._throttle()
+        with self.timer.span('navigate'):
+            try:
+                # The result page may share the form's URL, so first wait for it to go away
+                page = self._driver.find_element(By.TAG_NAME, 'html')
+                self._driver.execute_script("window.history.go(arguments[0])", -self._history)
+                self.wait.until(EC.staleness_of(page))
+                self.wait.until(lambda driver: driver.current_url == self._form_url)
+                search_button = self.wait.until(EC.element_to_be_clickable(SUBMIT_LOCATOR))
+                self._driver.execute_script(RESET_FORM_SCRIPT, list(FORM_FIELDS.values()))
+            except (TimeoutException, WebDriverException) as e:
+                logger.debug(f"Could not return to the search form, loading it again: {e}")
+                return None
+
+        self._history = 0
+        return search_button
+
+    def next_page(self):
+        """HTML of the next page of the current result list, or None at the end"""
+        next_page = find_next_page(self.driver.page_source, self.driver.current_url)
+        if next_page is None:
+            return None
+
+        self._throttle()
+        with self.timer.span('paginate'):
+            if next_page.submit is None:
+                self.driver.get(next_page.url)
+            else:
+                name, value = next_page.submit
+                button = self.driver.find_element(
+                    By.CSS_SELECTOR, f"input[name={_css_string(name)}][value={_css_string(value)}]")
+                button.click()
+                self.wait.until(EC.staleness_of(button))
+        self._history += 1
+
+        self._wait_for_results()
+        return self.driver.page_source
+
+    def has_next_page(self):
+        if self._driver is None:
+            return False
+        return find_next_page(self._driver.page_source, self._driver.current_url) is not None
+
+    def _wait_for_results(self):
+        """Wait for either a result list or the "no results" message"""
+        with self.timer.span('render'):
+            try:
+                self.wait.until(EC.any_of(
+                    EC.presence_of_element_located(RESULTS_LOCATOR),
+                    EC.presence_of_element_located(NO_RESULTS_LOCATOR),
+                    _parsed_with(PROFESSION_LOCATOR),
+                ))
+            except TimeoutException:
+                self.render_timeouts += 1
+                logger.warning(f"Result page {self.driver.current_url} did not show results "
+                               f"or a no-results message")
+
+    def _select_page_size(self):
+        """Pick the page size radio button if the form offers it"""
+        radios = self.driver.find_elements(
+            By.XPATH, f"//input[@type='radio' and @value='{self.page_size}']")
+        if radios and not radios[0].is_selected():
+            radios[0].click()
+
+    def _fill_search_form(self, criteria):
+        """Fill the search form with provided criteria"""
+        try:
+            # Name, city and postal code fields
+            for key, field_name in FORM_FIELDS.items():
+                if criteria.get(key):
+                    field = self.driver.find_element(By.NAME, field_name)
+                    field.clear()
+                    field.send_keys(criteria[key])
+
+            # Industry checkboxes
+            if criteria.get('industries'):
+                for industry in criteria['industries']:
+                    try:
+                        industry_checkbox = self.driver.find_element(
+                            By.XPATH, f"//input[@type='checkbox' and @value='{industry}']"
+                        )
+                        if not industry_checkbox.is_selected():
+                            industry_checkbox.click()
+                    except NoSuchElementException:
+                        continue
+
+        except Exception as e:
+            logger.warning(f"Error filling form: {e}")
+
+    def abort(self):
+        """Kill chromedriver from another thread, so a command stuck on a hung browser fails"""
+        driver = self._driver
+        if driver is None:
+            return
+        try:
+            driver.service.process.kill()
+        except Exception as e:
+            logger.warning(f"Could not kill chromedriver: {e}")
+
+    def close(self):
+        """Close the browser"""
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except Exception as e:
+                # Crashed or killed browsers cannot be quit cleanly
+                logger.warning(f"Error closing browser: {e}")
+            self._driver = None
+            self._form_url = None
+
+
+# Options only the Selenium backend takes
+SELENIUM_OPTIONS = ('headless', 'lean', 'profile_dir')
+
+FETCHER_BACKENDS = {
+    'http': HttpSearchFetcher,
+    'selenium': SeleniumSearchFetcher,
+}
+
+
+def create_fetcher(backend='http', **kwargs):
+    """Create a search backend by name"""
+    try:
+        fetcher_class = FETCHER_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown fetch backend '{backend}', choose from {sorted(FETCHER_BACKENDS)}")
+
+    if fetcher_class is not SeleniumSearchFetcher:
+        for option in SELENIUM_OPTIONS:
+            kwargs.pop(option, None)
+    return fetcher_class(**kwargs)
@@ -0,0 +1,95 @@
+import os
+import glob
+import random
+from html import escape
+
+# Building blocks for synthetic advisor entries
+FIRST_NAMES = ['Anna', 'Hans', 'Jürgen', 'Katrin', 'Michael', 'Sabine', 'Stefan', 'Ute', 'Özlem', 'Thomas',
+               'Birgit', 'Andreas', 'Claudia', 'Frank', 'Monika', 'Peter']
+SURNAMES = ['Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner', 'Becker', 'Schulz',
+            'Hoffmann', 'Schröder', 'Köhler', 'König', 'Weiß', 'Krüger', 'Hartmann']
+PROFESSIONS = ['Steuerberater', 'Steuerberaterin', 'Steuerbevollmächtigter', 'Wirtschaftsprüfer und Steuerberater']
+STREETS = ['Hauptstraße', 'Bahnhofstr.', 'Schillerstraße', 'Goethestr.', 'Am Marktplatz', 'Lindenallee',
+           'Kirchweg', 'Gartenstraße']
+CITIES = [('10115', 'Berlin'), ('20095', 'Hamburg'), ('80331', 'München'), ('50667', 'Köln'),
+          ('60311', 'Frankfurt am Main'), ('70173', 'Stuttgart'), ('04109', 'Leipzig'), ('90402', 'Nürnberg')]
+CHAMBERS = ['Steuerberaterkammer Berlin', 'Steuerberaterkammer Hamburg', 'Steuerberaterkammer München',
+            'Steuerberaterkammer Köln', 'Steuerberaterkammer Hessen', 'Steuerberaterkammer Stuttgart']
+
+
+def generate_advisors(count, seed=0):
+    """Reproducible list of synthetic advisor entries, each a list of text lines"""
+    rng = random.Random(seed)
+    advisors = []
+    for i in range(count):
+        female = rng.random() < 0.5
+        surname = rng.choice(SURNAMES)
+        postal_code, city = rng.choice(CITIES)
+        # Unique house numbers keep entries distinct however many are generated
+        lines = [
+            'Frau' if female else 'Herrn',
+            f"{rng.choice(['', 'Dr. ', 'Dipl.-Kfm. '])}{rng.choice(FIRST_NAMES)} {surname}",
+            rng.choice(PROFESSIONS),
+        ]
+        if rng.random() < 0.3:
+            lines.append(f"{surname} & Partner Steuerberatungsgesellschaft mbH")
+        lines += [
+            f"{rng.choice(STREETS)} {i + 1}",
+            f"{postal_code} {city}",
+            f"Tel.: 0{rng.randint(30, 999)} {rng.randint(100000, 9999999)}",
+        ]
+        if rng.random() < 0.6:
+            lines.append(f"Fax: 0{rng.randint(30, 999)} {rng.randint(100000, 9999999)}")
+        if rng.random() < 0.7:
+            lines.append(f"Email: kanzlei{i}@{surname.lower()}-stb.de")
+        if rng.random() < 0.5:
+            lines.append(f"Internet: www.{surname.lower()}-stb{i}.de")
+        lines.append(f"Zuständige Berufskammer: {rng.choice(CHAMBERS)}")
+        advisors.append(lines)
+    return advisors
+
+
+def render_start_page(action='/kasus/Suche', industries=()):
+    """HTML of a kasus start page with the advisor search form"""
+    checkboxes = ''.join(
+        f'<label><input type="checkbox" name="Branche" value="{escape(industry)}"> {escape(industry)}</label>'
+        for industry in industries)
+    return (
+        '<html><head><title>Steuerberatersuche</title></head><body>'
+        f'<form action="{action}" method="post">'
+        '<input type="hidden" name="KammerId" value="BuKa">'
+        '<input type="text" name="Name"><input type="text" name="Ort"><input type="text" name="Postleitzahl">'
+        f'{checkboxes}'
+        '<input type="radio" name="Anzahl" value="10" checked><input type="radio" name="Anzahl" value="25">'
+        '<input type="radio" name="Anzahl" value="50">'
+        '<input type="submit" name="Suchen" value="Suchen">'
+        '</form></body></html>'
+    )
+
+
+def render_result_page(advisors, next_url=None):
+    """HTML of a result page listing the given advisor entries"""
+    if not advisors:
+        return '<html><body><h1>Suchergebnis</h1><p>Es wurden keine Treffer gefunden.</p></body></html>'
+
+    entries = ''.join(
+        '<div class="treffer">' + ''.join(f'<p>{escape(line)}</p>' for line in lines) + '</div>'
+        for lines in advisors)
+    pager = f'<div class="pager"><a href="{escape(next_url)}">Weiter &raquo;</a></div>' if next_url else ''
+    return f'<html><body><h1>Suchergebnis</h1><div class="ergebnisliste">{entries}</div>{pager}</body></html>'
+
+
+def load_recorded_pages(directory):
+    """Recorded result pages (*.html) from a directory, in name order"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages.append(f.read())
+    return pages
+
+
+def synthetic_result_pages(pages=100, results_per_page=50, seed=0):
+    """Result pages built from synthetic advisors, for when no recordings are at hand"""
+    advisors = generate_advisors(pages * results_per_page, seed)
+    return [render_result_page(advisors[i:i + results_per_page])
+            for i in range(0, len(advisors), results_per_page)]
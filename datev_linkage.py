@@ -0,0 +1,256 @@
+import re
+import logging
+import unicodedata
+from collections import namedtuple
+from difflib import SequenceMatcher
+
+logger = logging.getLogger(__name__)
+
+TRANSLITERATION = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+
+# Salutations, academic titles and professional designations that vary between entries of one person
+NAME_TITLES = {
+    'herr', 'herrn', 'frau', 'prof', 'dr', 'dipl', 'kfm', 'kffr', 'kaufmann', 'kauffrau', 'betriebswirt',
+    'betriebswirtin', 'ing', 'rer', 'pol', 'oec', 'jur', 'med', 'mba', 'llm', 'stb', 'wp', 'vbp', 'ra',
+}
+NAME_NOISE = re.compile(r'\b(?:ll m|h c)\b')
+
+STREET_SUFFIX = re.compile(r'(?<=[a-z])(?:strasse|str)\b|\b(?:strasse|str)\b')
+HOUSE_NUMBER = re.compile(r'\b(\d+) ([a-z])\b')
+NUMBERS = re.compile(r'\d+[a-z]?')
+
+
+def normalize_text(text):
+    """Lowercase ASCII words: umlauts transliterated, accents and punctuation removed"""
+    text = (text or '').casefold().translate(TRANSLITERATION)
+    text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    return ' '.join(NON_ALPHANUMERIC.sub(' ', text).split())
+
+
+def normalize_name(name):
+    """Person or company name without salutation and titles, e.g. 'Dr. Jürgen Müller' -> 'juergen mueller'"""
+    text = NAME_NOISE.sub(' ', normalize_text(name))
+    return ' '.join(token for token in text.split() if token not in NAME_TITLES)
+
+
+def normalize_address(address):
+    """Street and house number with one spelling of 'Straße', e.g. 'Hauptstr. 12 a' -> 'hauptstr 12a'"""
+    text = STREET_SUFFIX.sub('str', normalize_text(address))
+    return HOUSE_NUMBER.sub(r'\1\2', text)
+
+
+def normalize_phone(phone):
+    """Digits of a German phone number in national format, e.g. '+49 (0)30 123' -> '030123'"""
+    text = (phone or '').strip().replace('(0)', '')
+    if text.startswith('+'):
+        text = '00' + text[1:]
+    digits = re.sub(r'\D', '', text)
+    if digits.startswith('0049'):
+        digits = '0' + digits[4:]
+    return digits
+
+
+def normalize_email(email):
+    """Lowercase address without a mailto: prefix"""
+    email = (email or '').strip().casefold()
+    return email[7:] if email.startswith('mailto:') else email
+
+
+def identity_key(name, address):
+    """Deduplication key of a record from its normalized name and address"""
+    return f"{normalize_name(name)}_{normalize_address(address)}".replace(' ', '_')
+
+
+# Kölner Phonetik codes of letters whose code does not depend on their neighbours
+PHONETIC_CODES = {}
+for letters, code in [('AEIJOUY', '0'), ('H', ''), ('B', '1'), ('FVW', '3'), ('GKQ', '4'), ('L', '5'),
+                      ('MN', '6'), ('R', '7'), ('SZ', '8')]:
+    for letter in letters:
+        PHONETIC_CODES[letter] = code
+
+
+def cologne_phonetic(word):
+    """Kölner Phonetik code of a word, equal for German names that sound alike (Meyer, Maier -> 67)"""
+    word = ''.join(char for char in normalize_text(word).upper() if 'A' <= char <= 'Z')
+    digits = []
+    for i, char in enumerate(word):
+        previous = word[i - 1] if i else ''
+        following = word[i + 1] if i + 1 < len(word) else ''
+        if char == 'P':
+            code = '3' if following == 'H' else '1'
+        elif char in 'DT':
+            code = '8' if following in ('C', 'S', 'Z') else '2'
+        elif char == 'C':
+            if i == 0:
+                code = '4' if following in ('A', 'H', 'K', 'L', 'O', 'Q', 'R', 'U', 'X') else '8'
+            elif previous in ('S', 'Z'):
+                code = '8'
+            else:
+                code = '4' if following in ('A', 'H', 'K', 'O', 'Q', 'U', 'X') else '8'
+        elif char == 'X':
+            code = '8' if previous in ('C', 'K', 'Q') else '48'
+        else:
+            code = PHONETIC_CODES.get(char, '')
+        digits.extend(code)
+
+    # Collapse repeated codes, then drop vowels except at the start
+    collapsed = [digit for i, digit in enumerate(digits) if i == 0 or digit != digits[i - 1]]
+    if not collapsed:
+        return ''
+    return collapsed[0] + ''.join(digit for digit in collapsed[1:] if digit != '0')
+
+
+# Normalized fields a record is compared by
+Profile = namedtuple('Profile', ['name', 'address', 'postal_code', 'phone', 'email'])
+
+
+def profile(record):
+    """Normalized comparison fields of a record; entries without a person name go by company"""
+    return Profile(
+        normalize_name(record.get('name') or record.get('company')),
+        normalize_address(record.get('address')),
+        (record.get('postal_code') or '').strip(),
+        normalize_phone(record.get('phone')),
+        normalize_email(record.get('email')),
+    )
+
+
+def _similar(a, b, threshold):
+    """Whether two normalized strings are alike, ignoring word order; cheap upper bounds go first"""
+    if a == b:
+        return True
+    matcher = SequenceMatcher(None, ' '.join(sorted(a.split())), ' '.join(sorted(b.split())))
+    return (matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold
+            and matcher.ratio() >= threshold)
+
+
+def _same_address(a, b, threshold):
+    """Alike streets with the same house number; neighbours differ in nothing else"""
+    if a == b:
+        return True
+    return NUMBERS.findall(a) == NUMBERS.findall(b) and _similar(NUMBERS.sub('', a), NUMBERS.sub('', b), threshold)
+
+
+def merge_records(records):
+    """One record from duplicates: the first one seen, with empty fields filled from the others"""
+    merged = dict(records[0])
+    for record in records[1:]:
+        for field, value in record.items():
+            if value and not merged.get(field):
+                merged[field] = value
+    return merged
+
+
+class RecordLinker:
+    """
+    Group records that describe the same advisor.
+
+    Each record is only compared with records sharing a blocking key: the
+    postal code with the phonetic code of the surname, the phone number or
+    the email address. That keeps matching close to linear in the number of
+    records. Two records match if their names are similar and they have a
+    similar address with the same house number, or share a phone number or
+    email address; colleagues of one office share those, so a name match is
+    always required. Matches are transitive.
+    """
+
+    def __init__(self, name_threshold=0.9, address_threshold=0.85, max_block=500):
+        self.name_threshold = name_threshold
+        self.address_threshold = address_threshold
+        self.max_block = max_block  # larger blocks are not compared further
+        self.profiles = []
+        self.blocks = {}
+        self._parent = []
+        self.comparisons = 0
+
+    def blocking_keys(self, fields):
+        keys = []
+        if fields.name:
+            tokens = fields.name.split()
+            keys.append(('postal', fields.postal_code, cologne_phonetic(tokens[-1])))
+        if fields.phone:
+            keys.append(('phone', fields.phone))
+        if fields.email:
+            keys.append(('email', fields.email))
+        return keys
+
+    def matches(self, a, b):
+        """Whether two profiles describe the same advisor"""
+        if not a.name or not _similar(a.name, b.name, self.name_threshold):
+            return False
+        if (a.phone and a.phone == b.phone) or (a.email and a.email == b.email):
+            return True
+        return bool(a.address and b.address) and _same_address(a.address, b.address, self.address_threshold)
+
+    def add(self, record):
+        """Add a record, return its position"""
+        position = len(self.profiles)
+        fields = profile(record)
+        self.profiles.append(fields)
+        self._parent.append(position)
+
+        compared = set()
+        for key in self.blocking_keys(fields):
+            block = self.blocks.setdefault(key, [])
+            if len(block) < self.max_block:
+                for other in block:
+                    if other in compared:
+                        continue
+                    compared.add(other)
+                    self.comparisons += 1
+                    if self.matches(fields, self.profiles[other]):
+                        self._union(other, position)
+            block.append(position)
+        return position
+
+    def _find(self, position):
+        while self._parent[position] != position:
+            self._parent[position] = self._parent[self._parent[position]]
+            position = self._parent[position]
+        return position
+
+    def _union(self, a, b):
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a != root_b:
+            # The earlier record stays the root, so merged records keep its unique_id
+            self._parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def clusters(self):
+        """Cluster root of each position"""
+        return [self._find(position) for position in range(len(self._parent))]
+
+
+def link_records(read_records, linker=None):
+    """
+    Merge near-duplicate records, streaming.
+
+    read_records() must return the same records in the same order each time
+    it is called, e.g. RecordStore.records. The first pass only keeps the
+    normalized fields of each record; the second yields records unchanged,
+    except that duplicates are held back until their group is complete and
+    then yielded once, merged.
+    """
+    linker = linker or RecordLinker()
+    for record in read_records():
+        linker.add(record)
+
+    roots = linker.clusters()
+    sizes = {}
+    for root in roots:
+        sizes[root] = sizes.get(root, 0) + 1
+
+    pending = {}
+    for position, record in enumerate(read_records()):
+        root = roots[position]
+        if sizes[root] == 1:
+            yield record
+            continue
+        group = pending.setdefault(root, [])
+        group.append(record)
+        if len(group) == sizes[root]:
+            yield merge_records(pending.pop(root))
+
+    duplicates = len(roots) - len(sizes)
+    logger.info(f"Record linkage: {len(roots)} records, {duplicates} duplicates merged into "
+                f"{sum(1 for size in sizes.values() if size > 1)} contacts, {linker.comparisons} comparisons")
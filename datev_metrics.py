@@ -0,0 +1,376 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Durations counted per latency bucket, with their sum and maximum"""
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # the last one is unbounded
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, share):
+        """Upper bound of the bucket holding the given share of durations, at most the maximum seen"""
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= share * self.count:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        """(upper bound, durations up to it) pairs, ending with infinity"""
+        counts = []
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.buckets):
+            seen += count
+            counts.append((bound, seen))
+        return counts
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total': round(self.total, 3),
+            'mean': round(self.total / self.count, 3) if self.count else 0.0,
+            'max': round(self.max, 3),
+            'p50': round(self.quantile(0.5), 3),
+            'p95': round(self.quantile(0.95), 3),
+            'p99': round(self.quantile(0.99), 3),
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): seen for bound, seen in self.cumulative()},
+        }
+
+
+class PhaseTimer:
+    """Accumulate wall-clock time spent in each phase of a search, as a latency histogram per phase"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {}  # phase -> Histogram
+
+    @contextmanager
+    def span(self, phase):
+        """Time the enclosed block and record it under the given phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    def record(self, phase, seconds):
+        """Record one measured duration for a phase"""
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.observe(seconds)
+
+    def summary(self):
+        """Per-phase count, total, mean, max and percentile seconds"""
+        with self._lock:
+            summary = {phase: histogram.as_dict() for phase, histogram in self.phases.items()}
+        for stats in summary.values():
+            del stats['buckets']
+        return summary
+
+    def histograms(self):
+        """Per-phase summary with the cumulative bucket counts"""
+        with self._lock:
+            return {phase: histogram.as_dict() for phase, histogram in self.phases.items()}
+
+    def log_summary(self):
+        """Log where the time went, slowest phase first"""
+        summary = self.summary()
+        for phase, stats in sorted(summary.items(), key=lambda item: -item[1]['total']):
+            logger.info(f"Phase {phase}: {stats['count']} calls, {stats['total']:.1f}s total, "
+                        f"{stats['mean']:.2f}s mean, {stats['p95']:.2f}s p95, {stats['max']:.2f}s max")
+
+
+def is_timeout(error):
+    """Whether an exception, or one it was raised from, is a timeout of the site or the browser"""
+    while error is not None:
+        if isinstance(error, TimeoutError) or 'timeout' in type(error).__name__.lower():
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def memory_mb():
+    """Current and peak resident memory of this process in MB, None where the platform does not tell"""
+    current = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    return {
+        'rss': round(current, 1) if current is not None else None,
+        'peak_rss': round(peak, 1) if peak is not None else None,
+    }
+
+
+class StrategyMetrics:
+    """Searches, failures and yield of one strategy"""
+
+    def __init__(self):
+        self.searches = 0
+        self.cached = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.render_timeouts = 0  # pages that did not render in time, not failures
+        self.errors = {}  # exception type -> count
+        self.results = 0
+        self.new_records = 0
+        self.latency = Histogram()
+
+    def as_dict(self):
+        return {
+            'searches': self.searches,
+            'cached': self.cached,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'render_timeouts': self.render_timeouts,
+            'errors': dict(self.errors),
+            'results': self.results,
+            'new_records': self.new_records,
+            'duplicates': self.results - self.new_records,
+            'new_share': round(self.new_records / self.results, 3) if self.results else 0.0,
+            'search_seconds': self.latency.as_dict(),
+        }
+
+
+class CrawlMetrics:
+    """
+    Structured counters of a running crawl.
+
+    Holds the phase timer, and per strategy the searches run, their latency,
+    failures by exception type (timeouts counted separately), result pages
+    the browser gave up waiting for and how many of the records they
+    returned were new. Sources registered with add_source
+    add live values of other components, e.g. the request count or the work
+    queue. A snapshot of all of it goes to a JSON run report, or is served by
+    a MetricsServer while the crawl runs.
+    """
+
+    def __init__(self, timer=None):
+        self.timer = timer or PhaseTimer()
+        self.started = time.time()
+        self.strategies = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def add_source(self, name, read):
+        """Include read() under name in every snapshot"""
+        self._sources[name] = read
+
+    def _strategy(self, strategy):
+        stats = self.strategies.get(strategy)
+        if stats is None:
+            stats = self.strategies[strategy] = StrategyMetrics()
+        return stats
+
+    def search(self, strategy, seconds, results, new_records, cached=False):
+        """Count a finished search and the records it returned"""
+        with self._lock:
+            stats = self._strategy(strategy)
+            stats.searches += 1
+            stats.cached += int(cached)
+            stats.results += results
+            stats.new_records += new_records
+            stats.latency.observe(seconds)
+
+    def failure(self, strategy, error):
+        """Count a failed search or search attempt"""
+        with self._lock:
+            stats = self._strategy(strategy)
+            stats.failures += 1
+            stats.timeouts += int(is_timeout(error))
+            name = type(error.__cause__ or error).__name__
+            stats.errors[name] = stats.errors.get(name, 0) + 1
+
+    def render_timeout(self, strategy, pages=1):
+        """Count result pages of a search that did not render in time; the search itself went on"""
+        with self._lock:
+            self._strategy(strategy).render_timeouts += pages
+
+    def snapshot(self):
+        """Everything measured so far as a JSON-serializable dict"""
+        elapsed = time.time() - self.started
+        minutes = elapsed / 60
+        with self._lock:
+            strategies = {name: stats.as_dict() for name, stats in self.strategies.items()}
+        searches = sum(stats['searches'] for stats in strategies.values())
+        new_records = sum(stats['new_records'] for stats in strategies.values())
+
+        snapshot = {
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec='seconds'),
+            'elapsed_seconds': round(elapsed, 1),
+            'searches': searches,
+            'searches_per_min': round(searches / minutes, 1) if minutes else 0.0,
+            'new_records': new_records,
+            'records_per_min': round(new_records / minutes, 1) if minutes else 0.0,
+            'memory_mb': memory_mb(),
+            'phases': self.timer.histograms(),
+            'strategies': strategies,
+        }
+        for name, read in self._sources.items():
+            try:
+                snapshot[name] = read()
+            except Exception as e:
+                snapshot[name] = {'error': str(e)}
+        return snapshot
+
+    def write_report(self, path):
+        """Write a snapshot to a JSON file, return it"""
+        snapshot = self.snapshot()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        logger.info(f"Run report saved to {path}")
+        return snapshot
+
+    def prometheus(self):
+        """The snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP datev_{name} {help_text}")
+            lines.append(f"# TYPE datev_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                lines.append(f"datev_{name}{{{label_text}}} {value}" if label_text else f"datev_{name} {value}")
+
+        def histogram(name, help_text, label, histograms):
+            samples = {'bucket': [], 'sum': [], 'count': []}
+            for value, stats in histograms.items():
+                for bound, seen in stats['buckets'].items():
+                    samples['bucket'].append(({label: value, 'le': bound}, seen))
+                samples['sum'].append(({label: value}, stats['total']))
+                samples['count'].append(({label: value}, stats['count']))
+            lines.append(f"# HELP datev_{name} {help_text}")
+            lines.append(f"# TYPE datev_{name} histogram")
+            for suffix, entries in samples.items():
+                for labels, value in entries:
+                    label_text = ','.join(f'{key}="{_escape(text)}"' for key, text in labels.items())
+                    lines.append(f"datev_{name}_{suffix}{{{label_text}}} {value}")
+
+        strategies = snapshot['strategies']
+        histogram('phase_seconds', "Time spent per phase of a search", 'phase', snapshot['phases'])
+        histogram('search_seconds', "Time per search, by strategy", 'strategy',
+                  {name: stats['search_seconds'] for name, stats in strategies.items()})
+        metric('searches_total', 'counter', "Finished searches",
+               [({'strategy': name}, stats['searches']) for name, stats in strategies.items()])
+        metric('search_failures_total', 'counter', "Failed searches and search attempts, by exception type",
+               [({'strategy': name, 'type': error}, count)
+                for name, stats in strategies.items() for error, count in stats['errors'].items()])
+        metric('search_timeouts_total', 'counter', "Failures that were timeouts",
+               [({'strategy': name}, stats['timeouts']) for name, stats in strategies.items()])
+        metric('render_timeouts_total', 'counter', "Result pages that did not render in time",
+               [({'strategy': name}, stats['render_timeouts']) for name, stats in strategies.items()])
+        metric('records_total', 'counter', "Records returned by searches, new or seen before",
+               [({'strategy': name, 'kind': kind}, stats[key]) for name, stats in strategies.items()
+                for kind, key in (('new', 'new_records'), ('duplicate', 'duplicates'))])
+        metric('records_per_minute', 'gauge', "New records per minute since the start",
+               [({}, snapshot['records_per_min'])])
+        metric('elapsed_seconds', 'gauge', "Seconds since the start of the crawl",
+               [({}, snapshot['elapsed_seconds'])])
+        memory = snapshot['memory_mb']
+        metric('memory_rss_bytes', 'gauge', "Resident memory of the scraper process",
+               [({'kind': kind}, int(memory[kind] * 1024 * 1024)) for kind in ('rss', 'peak_rss')
+                if memory[kind] is not None])
+
+        # Plain numbers from the registered sources
+        for name, value in snapshot.items():
+            if name in self._sources and isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric(name, 'gauge', f"Current {name.replace('_', ' ')}", [({}, value)])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint for watching a crawl while it runs.
+
+    Serves /metrics in the Prometheus text format and /metrics.json with the
+    same snapshot as the JSON run report.
+    """
+
+    def __init__(self, metrics, host='127.0.0.1', port=9108):
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics served on {self.url}")
+        return self
+
+    def stop(self):
+        """Stop serving"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, body, content_type, status=200):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            self._send(metrics.prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif path == '/metrics.json':
+            self._send(json.dumps(metrics.snapshot(), ensure_ascii=False), 'application/json')
+        else:
+            self._send('Not found, try /metrics or /metrics.json\n', 'text/plain; charset=utf-8', 404)
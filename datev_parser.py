@@ -0,0 +1,321 @@
+from collections import namedtuple
+from html.parser import HTMLParser
+import re
+
+from datev_linkage import identity_key
+
+# Elements that start a new line in the rendered page text
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+    'fieldset', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+    'hr', 'li', 'main', 'nav', 'ol', 'p', 'section', 'table', 'tbody', 'td',
+    'th', 'thead', 'tr', 'ul'
+}
+
+# Elements whose content is never visible
+SKIP_TAGS = {'head', 'script', 'style', 'noscript', 'template', 'title'}
+
+WHITESPACE = re.compile(r'\s+')
+
+
+class _TextExtractor(HTMLParser):
+    """Collect visible text of a page, one line per block element"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self._current = []
+        self._skip_depth = 0
+
+    def _break_line(self):
+        line = WHITESPACE.sub(' ', ''.join(self._current)).strip()
+        if line:
+            self.lines.append(line)
+        self._current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._break_line()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._break_line()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._break_line()
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._current.append(data)
+
+    def close(self):
+        super().close()
+        self._break_line()
+
+
+def html_to_text(html):
+    """Render page HTML to text lines, similar to WebDriver's body.text"""
+    extractor = _TextExtractor()
+    extractor.feed(html or '')
+    extractor.close()
+    return '\n'.join(extractor.lines)
+
+
+# Professions that mark a text block as an advisor entry
+PROFESSION_PATTERN = re.compile(r'Steuerberater|Steuerbevollmächtigte|Wirtschaftsprüfer')
+
+# Classes of result lists and their entries
+RESULT_CLASS_PATTERN = re.compile(r'result|treffer|ergebnis', re.IGNORECASE)
+
+# Elements that never have children
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'wbr'}
+
+# One advisor entry of a result page: its text lines and the links inside it
+ResultBlock = namedtuple('ResultBlock', ['lines', 'links'])
+
+
+class _Node:
+    """Element of the lightweight DOM built by _TreeBuilder"""
+    __slots__ = ('tag', 'attrs', 'children', 'parent')
+
+    def __init__(self, tag, attrs, parent):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []  # _Node or text
+        self.parent = parent
+
+    def signature(self):
+        """Tag and class, which repeated result entries share"""
+        return self.tag, self.attrs.get('class', '')
+
+
+class _TreeBuilder(HTMLParser):
+    """Build a lightweight DOM of the visible page content"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = _Node('#root', {}, None)
+        self.elements = []
+        self._current = self.root
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+
+        node = _Node(tag, {key: value or '' for key, value in attrs}, self._current)
+        self._current.children.append(node)
+        self.elements.append(node)
+        if tag not in VOID_TAGS:
+            self._current = node
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._skip_depth or tag in VOID_TAGS:
+            return
+
+        # Close up to the matching open element, stray end tags are ignored
+        node = self._current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self._current = node.parent
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._current.children.append(data)
+
+
+def _render(node, parts, links):
+    """Collect the text of a node with line breaks at block elements, and its links"""
+    for child in node.children:
+        if isinstance(child, str):
+            parts.append(child)
+            continue
+        if child.tag in BLOCK_TAGS:
+            parts.append('\n')
+        if child.tag == 'a' and child.attrs.get('href'):
+            links.append(child.attrs['href'])
+        _render(child, parts, links)
+        if child.tag in BLOCK_TAGS:
+            parts.append('\n')
+
+
+def _block(node):
+    parts = []
+    links = []
+    _render(node, parts, links)
+    lines = [WHITESPACE.sub(' ', line).strip() for line in ''.join(parts).split('\n')]
+    return ResultBlock([line for line in lines if line], links)
+
+
+def _is_result_entry(node):
+    """Whether an element or its parent is marked as part of a result list"""
+    return any(RESULT_CLASS_PATTERN.search(element.attrs.get('class', ''))
+               for element in (node, node.parent) if element is not None)
+
+
+def extract_result_blocks(html, min_lines=3):
+    """
+    Split a result page into one block per advisor using the page structure.
+
+    Result entries are repeated sibling elements with the same tag and class,
+    e.g. one div or table row per advisor. The sibling group holding the most
+    entries that mention a profession wins. A lone entry only counts if it or
+    its parent carries a result class, as on a page with a single result.
+    Returns an empty list if the page has no such structure, so callers can
+    fall back to the text heuristic.
+    """
+    builder = _TreeBuilder()
+    builder.feed(html or '')
+    builder.close()
+
+    best = []
+    for parent in [builder.root] + builder.elements:
+        groups = {}
+        for child in parent.children:
+            if not isinstance(child, str):
+                groups.setdefault(child.signature(), []).append(child)
+
+        for members in groups.values():
+            if len(members) < 2 and not _is_result_entry(members[0]):
+                continue
+            entries = [(member, _block(member)) for member in members]
+            entries = [(member, block) for member, block in entries
+                       if len(block.lines) >= min_lines and PROFESSION_PATTERN.search('\n'.join(block.lines))]
+            if not entries or (len(entries) == 1 and not _is_result_entry(entries[0][0])):
+                continue
+            # Prefer more entries; on a tie the later group in document order wins,
+            # which is the inner one when a wrapper holds a single list
+            if len(entries) >= len(best):
+                best = [block for member, block in entries]
+
+    return best
+
+
+def link_fields(links):
+    """Contact fields that a result entry carries as links rather than text"""
+    fields = {}
+    for href in links:
+        href = href.strip()
+        lower = href.lower()
+        if lower.startswith('mailto:') and 'email' not in fields:
+            fields['email'] = href[7:].split('?', 1)[0]
+        elif lower.startswith('tel:') and 'phone' not in fields:
+            fields['phone'] = href[4:]
+        elif lower.startswith(('http://', 'https://')) and 'datev.de' not in lower and 'website' not in fields:
+            fields['website'] = href
+    return fields
+
+
+# Bumped when parsing changes what records or their unique_id look like, so cached searches are parsed again
+RECORD_VERSION = 2
+
+# Fields of a parsed advisor entry, in the order they are exported
+RECORD_FIELDS = ('title', 'name', 'profession', 'company', 'address', 'city', 'postal_code', 'phone', 'fax',
+                 'mobile', 'email', 'website', 'chamber', 'unique_id', 'full_text')
+
+# Line classifiers, checked in this order
+TITLE_PATTERN = re.compile(r'^(?:Herrn|Frau)')
+CHAMBER_PATTERN = re.compile(r'Steuerberaterkammer')
+COMPANY_NAME_PATTERN = re.compile(r'GmbH|mbH|AG')
+COMPANY_PATTERN = re.compile(r'GmbH|mbH|AG|Partnerschaft|PartG')
+ADDRESS_PATTERN = re.compile(r'^[A-Za-zäöüÄÖÜß\s\-\.]+\s+\d+')
+POSTAL_CODE_PATTERN = re.compile(r'^\d{5}\s+[A-Za-zäöüÄÖÜß\s\-]+')
+CONTACT_PATTERN = re.compile(r'^(Tel\.:|Fax:|Mobil:|Email:|Internet:)(.*)')
+CONTACT_FIELDS = {'Tel.:': 'phone', 'Fax:': 'fax', 'Mobil:': 'mobile', 'Email:': 'email', 'Internet:': 'website'}
+
+
+class AdvisorRecord:
+    """Compact parsed advisor entry; to_dict() gives the plain dict used for storage and export"""
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self):
+        for field in RECORD_FIELDS:
+            setattr(self, field, '')
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in RECORD_FIELDS}
+
+    def __repr__(self):
+        return f"AdvisorRecord(name={self.name!r}, unique_id={self.unique_id!r})"
+
+
+def parse_advisor_block(block, keep_full_text=True):
+    """
+    Parse one advisor entry, given as text or as a list of lines, in a single pass.
+
+    Each line is classified once against precompiled patterns. Returns None
+    for blocks that are too short or have neither a name nor a company.
+    """
+    if isinstance(block, str):
+        lines = [line.strip() for line in block.split('\n') if line.strip()]
+    else:
+        lines = [line for line in block if line]
+
+    if len(lines) < 3:
+        return None
+
+    record = AdvisorRecord()
+    if keep_full_text:
+        record.full_text = block if isinstance(block, str) else '\n'.join(lines)
+
+    previous = ''
+    for line in lines:
+        if not record.title and TITLE_PATTERN.match(line):
+            record.title = line
+
+        # Checked before professions, "Steuerberaterkammer" contains "Steuerberater"
+        elif CHAMBER_PATTERN.search(line):
+            record.chamber = line.replace('Zuständige Berufskammer:', '').strip()
+
+        elif PROFESSION_PATTERN.search(line):
+            record.profession = line
+            # Previous line might be name if not company
+            if previous and not COMPANY_NAME_PATTERN.search(previous):
+                record.name = previous
+
+        elif COMPANY_PATTERN.search(line):
+            record.company = line
+
+        elif ADDRESS_PATTERN.match(line):
+            record.address = line
+
+        elif POSTAL_CODE_PATTERN.match(line):
+            postal_code, _, city = line.partition(' ')
+            record.postal_code = postal_code
+            record.city = city
+
+        else:
+            contact = CONTACT_PATTERN.match(line)
+            if contact:
+                setattr(record, CONTACT_FIELDS[contact.group(1)], contact.group(2).strip())
+
+        previous = line
+
+    # Create unique ID for deduplication; entries of a firm without a person go by the company
+    name_part = record.name or record.company
+    if not name_part:
+        return None
+    record.unique_id = identity_key(name_part, record.address)
+    return record
+
+
+def parse_advisor_blocks(blocks, keep_full_text=True):
+    """Parse many advisor entries at once, skipping those without a name or company"""
+    records = []
+    for block in blocks:
+        record = parse_advisor_block(block, keep_full_text)
+        if record is not None:
+            records.append(record)
+    return records
@@ -0,0 +1,401 @@
+import time
+import queue
+import logging
+import threading
+
+from datev_storage import unit_key
+
+logger = logging.getLogger(__name__)
+
+# Queue item that tells a stage worker to exit
+_STOP = object()
+
+
+class SearchUnit:
+    """One search on its way through the pipeline, with the pages and records read so far"""
+    __slots__ = ('strategy', 'criteria', 'variant', 'pages', 'page_results', 'page_count', 'results', 'cached',
+                 'error', 'started', 'more_pages', 'truncated', 'finished', 'render_timeouts')
+
+    def __init__(self, strategy, criteria, variant=None):
+        self.strategy = strategy
+        self.criteria = criteria
+        self.variant = variant
+        self.pages = []  # raw HTML in page order, for the cache
+        self.page_results = {}  # page index -> parsed records
+        self.page_count = None  # known once the fetcher has finished the search
+        self.results = None
+        self.cached = False
+        self.error = None
+        self.started = None  # when the fetch stage took it up
+        self.more_pages = False  # the site still offered a next page after max_pages
+        self.truncated = None
+        self.finished = False  # counted as done or failed, later stage items are dropped
+        self.render_timeouts = 0  # pages the browser gave up waiting for
+
+    @property
+    def key(self):
+        return unit_key(self.criteria, self.variant)
+
+
+class ResultPages:
+    """
+    Records of one search, added page by page in page order.
+
+    A page without records that earlier pages did not have ends the search:
+    the list is over, or the site served the same page again.
+    """
+
+    def __init__(self):
+        self.results = []
+        self.read = 0  # pages that added records
+        self.last_page_rows = 0
+        self.ended = False  # stopped on a page without new records
+        self._seen_ids = set()
+
+    def add(self, page_results):
+        """Add the records of the next page, False if none were new and the search ends"""
+        new_results = [r for r in page_results if r['unique_id'] not in self._seen_ids]
+        if not new_results:
+            self.ended = True
+            return False
+        self._seen_ids.update(r['unique_id'] for r in new_results)
+        self.results.extend(new_results)
+        self.read += 1
+        self.last_page_rows = len(page_results)
+        return True
+
+
+class Stage:
+    """
+    Worker threads draining one bounded queue.
+
+    Tracks how long the workers were busy and how much of that they spent
+    blocked on a full downstream queue, which gives per-stage utilization.
+    An item whose handler raises is passed to on_error.
+    """
+
+    def __init__(self, name, handler, workers=1, maxsize=0, on_error=None):
+        self.name = name
+        self.handler = handler  # handler(item, worker_index)
+        self.on_error = on_error  # on_error(item, exception)
+        self.queue = queue.Queue(maxsize)
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+        self._started = None
+        self._threads = [threading.Thread(target=self._run, args=(i,), name=f"{name}-{i}", daemon=True)
+                         for i in range(workers)]
+
+    def start(self):
+        self._started = time.perf_counter()
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Let the workers finish what is queued, then exit"""
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def emit(self, stage, item):
+        """Hand an item to the next stage, counting time spent waiting for room in its queue"""
+        start = time.perf_counter()
+        stage.put(item)
+        with self._lock:
+            self.blocked += time.perf_counter() - start
+
+    def _run(self, worker):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            start = time.perf_counter()
+            try:
+                self.handler(item, worker)
+            except Exception as e:
+                logger.error(f"{self.name} stage failed: {e}")
+                if self.on_error:
+                    self.on_error(item, e)
+            finally:
+                with self._lock:
+                    self.items += 1
+                    self.busy += time.perf_counter() - start
+
+    def stats(self):
+        """Queue depth, items handled and the share of worker time spent working or blocked"""
+        capacity = (time.perf_counter() - self._started) * len(self._threads) if self._started else 0.0
+        with self._lock:
+            return {
+                'queued': self.queue.qsize(),
+                'maxsize': self.queue.maxsize,
+                'workers': len(self._threads),
+                'items': self.items,
+                'utilization': round((self.busy - self.blocked) / capacity, 3) if capacity else 0.0,
+                'blocked': round(self.blocked / capacity, 3) if capacity else 0.0,
+            }
+
+
+class CrawlPipeline:
+    """
+    Fetch, parse, dedup and persist stages of a crawl, connected by bounded queues.
+
+    The fetch stage only talks to the site and hands each result page on, so
+    requests keep going while earlier pages are parsed and stored. Parsing
+    runs on a pool of workers. A single merge stage assembles the pages of a
+    search and passes it to a single writer that stores its records and marks
+    it done, in that order, with the same helpers as the serial crawl.
+    Bounded queues keep at most a few pages in memory per stage.
+
+    Unlike the serial crawl, the fetcher cannot see whether a page had new
+    results, so it follows next-page links until the last page, a repeated
+    page or max_pages.
+
+    With several fetchers, each one is a fetch worker pulling searches from
+    the same queue; they share the scraper's rate limiter, so the load on the
+    server stays the same however many there are. A worker whose search fails
+    restarts its backend and retries the search, up to max_attempts. A worker
+    that makes no progress for hang_timeout seconds has its backend aborted by
+    a watchdog, which turns the hang into such a failure.
+    """
+
+    def __init__(self, scraper, fetchers=None, parse_workers=2, queue_size=8, log_every=30.0, max_attempts=3,
+                 hang_timeout=None):
+        self.scraper = scraper
+        self.fetchers = fetchers or [scraper.fetcher]
+        self.log_every = log_every
+        self.max_attempts = max_attempts
+        self.hang_timeout = hang_timeout
+        self.restarts = 0
+
+        self.fetch = Stage('fetch', self._fetch, workers=len(self.fetchers), maxsize=queue_size, on_error=self._fail)
+        self.parse = Stage('parse', self._parse, workers=parse_workers, maxsize=queue_size * 4, on_error=self._fail)
+        self.merge = Stage('merge', self._merge, maxsize=queue_size * 4, on_error=self._fail)
+        self.persist = Stage('persist', self._persist, maxsize=queue_size, on_error=self._fail)
+        self.stages = [self.fetch, self.parse, self.merge, self.persist]
+
+        self._outstanding = 0
+        self._counts = {}
+        self._done = threading.Condition()
+
+        # When each fetch worker last made progress, None while idle
+        self._heartbeats = [None] * len(self.fetchers)
+        self._stopping = threading.Event()
+        self._cancelled = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        if self.hang_timeout:
+            self._watchdog = threading.Thread(target=self._watch, name='fetch-watchdog', daemon=True)
+            self._watchdog.start()
+        return self
+
+    def cancel(self):
+        """
+        Stop searching, e.g. on an interrupt: searches not started yet are
+        dropped and stay pending in the work queue, running ones end after
+        their current page and count as failed. stop() then only drains what
+        was already read.
+        """
+        self._cancelled.set()
+
+    def stop(self):
+        """Drain the stages front to back and stop their workers"""
+        for stage in self.stages:
+            stage.stop()
+        self._stopping.set()
+        if self._watchdog:
+            self._watchdog.join()
+
+    def _watch(self):
+        """Abort the backend of a fetch worker that has not made progress for hang_timeout seconds"""
+        while not self._stopping.wait(max(1.0, self.hang_timeout / 4)):
+            now = time.monotonic()
+            for worker, heartbeat in enumerate(self._heartbeats):
+                if heartbeat is not None and now - heartbeat > self.hang_timeout:
+                    logger.warning(f"Fetch worker {worker} made no progress for {now - heartbeat:.0f}s, aborting it")
+                    self._heartbeats[worker] = now
+                    try:
+                        self.fetchers[worker].abort()
+                    except Exception as e:
+                        logger.error(f"Could not abort fetch worker {worker}: {e}")
+
+    def run(self, strategy, units):
+        """Search (criteria, variant) units of a strategy, return SearchResults by unit key; failed units are missing"""
+        counts = {}
+        with self._done:
+            self._counts = counts
+
+        for criteria, variant in units:
+            # Finished before a resume or stable since the last refresh: nothing to do
+            result = self.scraper._finished_result(strategy, criteria, variant)
+            if result is not None:
+                counts[unit_key(criteria, variant)] = result
+                continue
+            with self._done:
+                self._outstanding += 1
+            self.fetch.put(SearchUnit(strategy, criteria, variant))
+
+        with self._done:
+            while self._outstanding:
+                if not self._done.wait(timeout=self.log_every):
+                    self.log_stats()
+        return counts
+
+    def _finish(self, unit, result):
+        with self._done:
+            if unit.finished:
+                return
+            unit.finished = True
+            if result is not None:
+                self._counts[unit.key] = result
+            self._outstanding -= 1
+            self._done.notify_all()
+
+    def _fail(self, item, error):
+        """Fail the search of an item whose stage raised, so run() does not wait for it"""
+        unit = item if isinstance(item, SearchUnit) else item[0]
+        if unit.finished:
+            return
+        unit.error = str(error)
+        try:
+            # Searched again on resume, like a search whose fetch failed
+            self.scraper.work_queue.fail(unit.strategy, unit.criteria, unit.variant)
+        except Exception as e:
+            logger.error(f"Could not mark {unit.criteria} as failed: {e}")
+        self._finish(unit, None)
+
+    def _fetch(self, unit, worker):
+        scraper = self.scraper
+        if self._cancelled.is_set():
+            self._finish(unit, None)
+            return
+        logger.info(f"Searching {unit.strategy}: {unit.criteria or 'no criteria'}")
+        unit.started = time.perf_counter()
+
+        if scraper.cache:
+            cached = scraper.cache.get(unit.criteria, unit.variant)
+            if cached is not None:
+                unit.results, unit.truncated = cached
+                unit.cached = True
+                self.fetch.emit(self.merge, (unit, None, 0))
+                return
+
+        scraper.work_queue.start(unit.strategy, unit.criteria, unit.variant)
+        fetcher = self.fetchers[worker]
+        render_timeouts = fetcher.render_timeouts
+        for attempt in range(1, self.max_attempts + 1):
+            self._heartbeats[worker] = time.monotonic()
+            try:
+                self._fetch_pages(unit, fetcher, worker)
+                break
+            except Exception as e:
+                logger.error(f"Search failed: {e}")
+                scraper.metrics.failure(unit.strategy, e)
+                if attempt == self.max_attempts or self._cancelled.is_set():
+                    unit.error = str(e)
+                    break
+                error = str(e)
+                # A crashed or aborted backend is replaced and the search tried again
+                logger.warning(f"Restarting fetch worker {worker} after a failed search of {unit.criteria}")
+                with self._done:
+                    self.restarts += 1
+                try:
+                    fetcher.restart()
+                except Exception as e:
+                    logger.error(f"Could not restart fetch worker {worker}: {e}")
+                # An empty search returns other results every time, so the pages already handed on cannot be
+                # continued; it fails and is searched again from the first page on resume
+                if not unit.criteria:
+                    unit.error = error
+                    break
+                logger.warning(f"Attempt {attempt + 1} of {unit.criteria}")
+        self._heartbeats[worker] = None
+        unit.render_timeouts = fetcher.render_timeouts - render_timeouts
+
+        # End marker, carrying the number of pages the merge stage waits for
+        self.fetch.emit(self.parse, (unit, None, len(unit.pages)))
+
+    def _fetch_pages(self, unit, fetcher, worker):
+        previous = None
+        unit.more_pages = False
+        for index, html in enumerate(fetcher.fetch_pages(unit.criteria, self.scraper.max_pages)):
+            self._heartbeats[worker] = time.monotonic()
+            if self._cancelled.is_set():
+                unit.error = "cancelled"
+                break
+            # The site serving the same page again means there are no more
+            if html == previous:
+                break
+            previous = html
+            # After a restart, pages handed on by the failed attempt are skipped
+            if index < len(unit.pages):
+                continue
+            # Waiting for room downstream is not a hang, only time inside the fetcher counts
+            self._heartbeats[worker] = None
+            self.fetch.emit(self.parse, (unit, index, html))
+            self._heartbeats[worker] = time.monotonic()
+            unit.pages.append(html)
+        else:
+            unit.more_pages = len(unit.pages) == self.scraper.max_pages and fetcher.has_next_page()
+
+    def _parse(self, item, worker):
+        unit, index, html = item
+        if index is None:
+            self.parse.emit(self.merge, item)
+            return
+        with self.scraper.timer.span('extract'):
+            records = self.scraper._extract_page_results(html)
+        self.parse.emit(self.merge, (unit, index, records))
+
+    def _merge(self, item, worker):
+        unit, index, value = item
+        # Failed in an earlier stage, the rest of its pages are dropped
+        if unit.finished:
+            return
+        if index is None:
+            unit.page_count = value
+        else:
+            unit.page_results[index] = value
+
+        # Pages arrive in any order from the parser pool
+        if unit.page_count is None or len(unit.page_results) < unit.page_count:
+            return
+
+        if unit.results is None:
+            # Same stop rule and truncation check as the serial crawl
+            pages = ResultPages()
+            for index in range(unit.page_count):
+                if not pages.add(unit.page_results[index]):
+                    break
+            unit.results = pages.results
+            unit.truncated = self.scraper._truncated(unit.criteria, pages, unit.more_pages)
+            unit.page_results = None
+        self.merge.emit(self.persist, unit)
+
+    def _persist(self, unit, worker):
+        # The single writer is the only stage that touches all_contacts while the pipeline runs
+        result = self.scraper._save_unit(unit.strategy, unit.criteria, unit.variant, unit.results, unit.truncated,
+                                         unit.started, pages=None if unit.cached else unit.pages,
+                                         failed=bool(unit.error), render_timeouts=unit.render_timeouts)
+        self._finish(unit, result)
+
+    def stats(self):
+        """Queue depth and utilization of each stage, and fetch worker restarts"""
+        stats = {stage.name: stage.stats() for stage in self.stages}
+        stats['fetch']['restarts'] = self.restarts
+        return stats
+
+    def log_stats(self):
+        """Log queue depths and how busy each stage is"""
+        for name, stats in self.stats().items():
+            logger.info(f"Stage {name}: {stats['queued']}/{stats['maxsize']} queued, {stats['items']} items, "
+                        f"{stats['utilization']:.0%} busy, {stats['blocked']:.0%} blocked downstream")
+        if self.restarts:
+            logger.info(f"Fetch workers restarted {self.restarts} times")
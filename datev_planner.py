@@ -0,0 +1,157 @@
+import json
+import logging
+from collections import deque
+from itertools import product
+
+logger = logging.getLogger(__name__)
+
+# Major industries from the search form
+INDUSTRIES = [
+    'Einzelhandel', 'Ärzte', 'Rechtsanwälte', 'Immobilienmakler', 'Bauunternehmen - Hochbau',
+    'Gaststätten, Hotel- und Übernachtungsgewerbe', 'Handwerksbetriebe', 'Unternehmensberater',
+    'Freiberufler', 'Großhandel', 'Maschinenbau', 'Kfz-Handel', 'Banken / Kreditinstitute / Bausparkassen',
+    'Versicherungen', 'Immobilienverwalter', 'Steuerberater', 'Wirtschaftsprüfer', 'Import-/Exportunternehmen',
+    'Softwareentwicklung', 'Medien', 'Agrarwirtschaft, Land- und Forstwirte', 'Apotheken',
+    'Zahnärzte', 'Architekten', 'Ingenieure', 'Verlage', 'Fotografen', 'Bäcker / Konditor',
+    'Friseure', 'Elektrohandwerk', 'Heilberufe', 'Bildungseinrichtungen'
+]
+
+
+def normalize_criteria(criteria):
+    """Drop empty fields, strip text and sort industries so equal searches compare equal"""
+    normalized = {}
+    for key, value in criteria.items():
+        if isinstance(value, str):
+            value = value.strip()
+        elif isinstance(value, (list, tuple, set)):
+            value = sorted({str(item).strip() for item in value if str(item).strip()})
+        if value:
+            normalized[key] = value
+    return normalized
+
+
+def criteria_key(criteria):
+    """Stable string key for a criteria dict"""
+    return json.dumps(normalize_criteria(criteria), sort_keys=True, ensure_ascii=False)
+
+
+def combine_criteria(*dimensions):
+    """Cross several lists of criteria dicts, e.g. postal prefixes x industries"""
+    return [
+        {key: value for part in parts for key, value in part.items()}
+        for parts in product(*dimensions)
+    ]
+
+
+def postal_prefixes(length=2):
+    """All German postal code prefixes of the given length ("01" .. "99")"""
+    return [f"{i:0{length}d}" for i in range(1, 10 ** length)]
+
+
+def refine_postal_code(criteria):
+    """Split a postal prefix into its ten one-digit-longer prefixes"""
+    prefix = criteria.get('postal_code', '')
+    if not prefix or len(prefix) >= 5:
+        return []
+    return [dict(criteria, postal_code=f"{prefix}{digit}") for digit in range(10)]
+
+
+def refine_by_industry(industries):
+    """Build a refiner that splits a query without industry filter into one query per industry"""
+    def refine(criteria):
+        if criteria.get('industries'):
+            return []
+        return [dict(criteria, industries=[industry]) for industry in industries]
+    return refine
+
+
+class QueryPlanner:
+    """
+    Plan searches so that each one returns fewer results than the cap.
+
+    A truncated query, one whose result list the site cut off, is replaced by
+    narrower queries from the first refiner that can split it. Complete
+    queries are never repeated. Where the search could not tell whether it
+    was truncated, a result count reaching the cap counts as truncated. Each seed starts with an equal
+    share of the search space and children split their parent's share, which
+    gives a running coverage estimate.
+    """
+
+    def __init__(self, seeds, refiners=(refine_postal_code,), cap=50, name='planner', log_every=10):
+        self.refiners = list(refiners)
+        self.cap = cap
+        self.name = name
+        self.log_every = log_every
+
+        weight = 1.0 / len(seeds) if seeds else 0.0
+        self.frontier = deque((criteria, weight) for criteria in seeds)
+        self.pending = {}
+        self.queries = 0
+        self.refined = 0
+        self.covered = 0.0  # share of the space whose results were seen completely
+        self.truncated = 0.0  # share that stayed capped and could not be refined further
+
+    def __iter__(self):
+        while True:
+            criteria = self.next_query()
+            if criteria is None:
+                return
+            yield criteria
+
+    def next_query(self):
+        """Next criteria to search, or None when the plan is exhausted"""
+        if not self.frontier:
+            return None
+        criteria, weight = self.frontier.popleft()
+        self.pending[criteria_key(criteria)] = weight
+        return criteria
+
+    def report(self, criteria, result_count, truncated=None):
+        """Record how many results a planned query returned, return the narrower queries replacing it"""
+        weight = self.pending.pop(criteria_key(criteria), 0.0)
+        self.queries += 1
+        children = []
+
+        if truncated is None:
+            truncated = result_count >= self.cap
+        if truncated:
+            children = self._refine(criteria)
+            if children:
+                self.refined += 1
+                child_weight = weight / len(children)
+                # Depth-first, so a dense region is finished before moving on
+                self.frontier.extendleft((child, child_weight) for child in reversed(children))
+            else:
+                logger.warning(f"Query {criteria} still returns {result_count} results and cannot be refined")
+                self.truncated += weight
+        else:
+            self.covered += weight
+
+        if self.log_every and self.queries % self.log_every == 0:
+            self.log_progress()
+
+        return children
+
+    def _refine(self, criteria):
+        for refine in self.refiners:
+            children = refine(criteria)
+            if children:
+                return children
+        return []
+
+    def progress(self):
+        """Queries issued so far, frontier size and coverage estimate"""
+        return {
+            'queries': self.queries,
+            'frontier': len(self.frontier),
+            'refined': self.refined,
+            'coverage': round(self.covered, 4),
+            'truncated': round(self.truncated, 4),
+        }
+
+    def log_progress(self):
+        """Log the current frontier and coverage estimate"""
+        progress = self.progress()
+        logger.info(f"{self.name}: {progress['queries']} queries, {progress['frontier']} in frontier, "
+                    f"{progress['refined']} refined, coverage ~{progress['coverage']:.1%}, "
+                    f"truncated ~{progress['truncated']:.1%}")
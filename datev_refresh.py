@@ -0,0 +1,178 @@
+import os
+import json
+import sqlite3
+import logging
+from collections import namedtuple
+
+from datev_export import EXPORT_COLUMNS, export_records
+from datev_storage import UNHASHED_FIELDS, _connect, unit_key
+
+logger = logging.getLogger(__name__)
+
+# Columns of the change feed in front of the contact columns
+DELTA_COLUMNS = ['change', 'changed_fields'] + EXPORT_COLUMNS
+
+# What a previous crawl knows about a finished search
+PreviousUnit = namedtuple('PreviousUnit', ['result_count', 'result_hash', 'stable_runs', 'skipped_runs',
+                                           'truncated'])
+
+
+def changed_fields(old, new):
+    """Names of the fields that differ between two versions of a record"""
+    fields = (set(old) | set(new)) - set(UNHASHED_FIELDS)
+    return sorted(field for field in fields if (old.get(field) or '') != (new.get(field) or ''))
+
+
+class RefreshPlan:
+    """
+    Refresh of an earlier crawl, recorded in its state file.
+
+    Searches whose result set hashed the same in the last refreshes are
+    deprioritized: instead of being searched they reuse their previous
+    results, for as many refreshes in a row as they have been stable (at most
+    max_skips), and are then searched again. Searches without criteria
+    return arbitrary results and are only repeated every max_skips + 1
+    refreshes. Everything else is searched as usual into a new state file.
+
+    finish() then compares the two stores in SQLite. Records are matched by
+    unique_id and compared by content hash only, so unchanged records cost
+    one comparison each. A record counts as disappeared only when a search
+    with criteria that returned it last time ran again and nothing returned
+    it; other records that were not seen again are carried over unchanged,
+    so the new state file is a complete baseline for the next refresh.
+    """
+
+    def __init__(self, previous_path, max_skips=4):
+        if not os.path.exists(previous_path):
+            raise FileNotFoundError(f"No previous crawl to refresh at {previous_path}")
+        self.previous_path = previous_path
+        self.max_skips = max_skips
+        self.skipped = 0
+
+        connection = sqlite3.connect(f"file:{previous_path}?mode=ro", uri=True)
+        try:
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(work_units)")}
+            if 'result_hash' not in columns:
+                raise ValueError(f"{previous_path} was written before result hashes were kept, "
+                                 f"run a full crawl to refresh from")
+            # Crawls from before truncation was recorded leave it unknown
+            truncated = 'truncated' if 'truncated' in columns else 'NULL'
+            self.units = {
+                (strategy, key): PreviousUnit(*values)
+                for strategy, key, *values in connection.execute(
+                    f"SELECT strategy, unit_key, result_count, result_hash, stable_runs, skipped_runs, {truncated} "
+                    f"FROM work_units WHERE status = 'done'")
+            }
+            previous_records = connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        finally:
+            connection.close()
+        logger.info(f"Refreshing {previous_path}: {len(self.units)} finished searches, "
+                    f"{previous_records} records")
+
+    def skip(self, strategy, criteria, variant=None):
+        """What the previous crawl knows about a search that need not run this time, None if it should run"""
+        previous = self.units.get((strategy, unit_key(criteria, variant)))
+        if previous is None or previous.result_hash is None:
+            return None
+        # An empty search returns an arbitrary selection that is never the same twice and finds nothing the
+        # searches with criteria miss, so it only runs again every max_skips + 1 refreshes
+        limit = min(previous.stable_runs, self.max_skips) if criteria else self.max_skips
+        if previous.skipped_runs >= limit:
+            return None
+        self.skipped += 1
+        return previous
+
+    def finish(self, state_path, delta_path=None, full_text='drop'):
+        """Compare the refreshed crawl with the previous one, write the change feed, return change counts"""
+        connection = _connect(state_path)
+        try:
+            connection.execute("ATTACH DATABASE ? AS previous", (self.previous_path,))
+            stats = self._compare(connection, delta_path, full_text)
+            connection.commit()
+            connection.execute("DETACH DATABASE previous")
+        finally:
+            connection.close()
+
+        logger.info(f"Refresh of {self.previous_path}: {stats['added']} added, {stats['changed']} changed, "
+                    f"{stats['disappeared']} disappeared, {stats['unchanged']} unchanged, "
+                    f"{stats['carried_over']} carried over; {self.skipped} stable searches skipped")
+        return stats
+
+    def _compare(self, connection, delta_path, full_text):
+        # Searches that ran again and returned the same results are one refresh more stable
+        connection.execute("""
+            UPDATE work_units SET stable_runs = (
+                SELECT p.stable_runs + 1 FROM previous.work_units p
+                WHERE p.strategy = work_units.strategy AND p.unit_key = work_units.unit_key)
+            WHERE status = 'done' AND skipped_runs = 0 AND EXISTS (
+                SELECT 1 FROM previous.work_units p
+                WHERE p.strategy = work_units.strategy AND p.unit_key = work_units.unit_key
+                  AND p.result_hash = work_units.result_hash)
+        """)
+        # Skipped searches keep the results they had
+        connection.execute("""
+            INSERT OR IGNORE INTO unit_results
+            SELECT p.strategy, p.unit_key, p.unique_id FROM previous.unit_results p
+            JOIN work_units w ON w.strategy = p.strategy AND w.unit_key = p.unit_key
+            WHERE w.skipped_runs > 0
+        """)
+        # Gone: a search with criteria that found the record last time ran again, and no search found it
+        connection.execute("DROP TABLE IF EXISTS temp.gone")
+        connection.execute("""
+            CREATE TEMP TABLE gone AS
+            SELECT DISTINCT p.unique_id FROM previous.unit_results p
+            JOIN work_units w ON w.strategy = p.strategy AND w.unit_key = p.unit_key
+            WHERE w.status = 'done' AND w.skipped_runs = 0 AND w.criteria != '{}'
+              AND p.unique_id NOT IN (SELECT unique_id FROM records)
+        """)
+
+        stats = {
+            'added': connection.execute(
+                "SELECT COUNT(*) FROM records WHERE unique_id NOT IN (SELECT unique_id FROM previous.records)"
+            ).fetchone()[0],
+            'changed': connection.execute(
+                "SELECT COUNT(*) FROM records r JOIN previous.records p ON p.unique_id = r.unique_id "
+                "WHERE p.content_hash IS NOT r.content_hash").fetchone()[0],
+            'unchanged': connection.execute(
+                "SELECT COUNT(*) FROM records r JOIN previous.records p ON p.unique_id = r.unique_id "
+                "WHERE p.content_hash IS r.content_hash").fetchone()[0],
+            'disappeared': connection.execute("SELECT COUNT(*) FROM gone").fetchone()[0],
+            'skipped_searches': self.skipped,
+        }
+        if delta_path:
+            export = export_records(self._changes(connection), delta_path, full_text=full_text,
+                                    columns=DELTA_COLUMNS)
+            logger.info(f"Change feed saved: {export['rows']} changes in {delta_path}")
+
+        # Records not seen again but not shown to be gone stay in the crawl as they were
+        before = connection.total_changes
+        connection.execute("""
+            INSERT OR IGNORE INTO records (unique_id, record, found, content_hash)
+            SELECT unique_id, record, found, content_hash FROM previous.records
+            WHERE unique_id NOT IN (SELECT unique_id FROM gone) ORDER BY seq
+        """)
+        stats['carried_over'] = connection.total_changes - before
+        return stats
+
+    def _changes(self, connection, batch_size=1000):
+        """Added, changed and disappeared records, each with its change type and the fields that changed"""
+        queries = [
+            ('added', "SELECT r.record, NULL FROM records r "
+                      "WHERE r.unique_id NOT IN (SELECT unique_id FROM previous.records) ORDER BY r.seq"),
+            ('changed', "SELECT r.record, p.record FROM records r JOIN previous.records p "
+                        "ON p.unique_id = r.unique_id WHERE p.content_hash IS NOT r.content_hash ORDER BY r.seq"),
+            ('disappeared', "SELECT p.record, NULL FROM previous.records p "
+                            "WHERE p.unique_id IN (SELECT unique_id FROM gone) ORDER BY p.seq"),
+        ]
+        for change, query in queries:
+            cursor = connection.execute(query)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for record, old in rows:
+                    record = json.loads(record)
+                    if old is not None:
+                        record['changed_fields'] = ' '.join(changed_fields(json.loads(old), record))
+                    record['change'] = change
+                    yield record
@@ -0,0 +1,226 @@
+import os
+import re
+import time
+import random
+import argparse
+import logging
+import threading
+from itertools import count
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from datev_fixtures import generate_advisors, load_recorded_pages, render_result_page, render_start_page
+from datev_planner import INDUSTRIES
+
+logger = logging.getLogger(__name__)
+
+START_PATH = '/kasus/Start'
+SEARCH_PATH = '/kasus/Suche'
+RESULTS_PATH = '/kasus/Ergebnis'
+
+POSTAL_LINE = re.compile(r'^(\d{5}) (.+)$')
+
+
+class _Advisor:
+    """Synthetic directory entry with the fields the search form filters on"""
+    __slots__ = ('lines', 'name', 'postal_code', 'city', 'industries')
+
+    def __init__(self, lines, industries):
+        self.lines = lines
+        self.name = lines[1].casefold()
+        self.postal_code = ''
+        self.city = ''
+        for line in lines:
+            match = POSTAL_LINE.match(line)
+            if match:
+                self.postal_code, city = match.groups()
+                self.city = city.casefold()
+                break
+        self.industries = industries
+
+
+class ReplayServer:
+    """
+    Local stand-in for the kasus search, for offline tests and benchmarks.
+
+    Serves a start page with the search form, answers searches from a synthetic
+    advisor directory (or replays recorded result pages) and pages through
+    result lists with "Weiter" links. Latency, directory size and the number of
+    results returned by an empty search are configurable.
+    """
+
+    def __init__(self, advisor_count=5000, latency=0.0, jitter=0.0, random_size=500, industries=INDUSTRIES,
+                 fixtures=None, seed=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.random_size = random_size
+        self.industries = list(industries)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._result_lists = OrderedDict()  # token -> (advisors, page size)
+        self._tokens = count(1)
+
+        rng = random.Random(seed)
+        self.advisors = [
+            _Advisor(lines, set(rng.sample(self.industries, min(3, len(self.industries)))))
+            for lines in generate_advisors(advisor_count, seed)
+        ]
+
+        # Recorded pages replace the synthetic directory when given
+        self.start_page = None
+        self.recorded_pages = []
+        if fixtures:
+            start_path = os.path.join(fixtures, 'start.html')
+            if os.path.exists(start_path):
+                with open(start_path, encoding='utf-8') as f:
+                    self.start_page = f.read()
+            self.recorded_pages = [page for page in load_recorded_pages(fixtures) if page != self.start_page]
+
+        self.httpd = ThreadingHTTPServer((host, port), _ReplayHandler)
+        self.httpd.replay = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """Start page URL to use as the scraper's base URL"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{START_PATH}"
+
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Replay server listening on {self.url}")
+        return self
+
+    def stop(self):
+        """Stop serving"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def delay(self):
+        """Simulated server latency"""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def search(self, form):
+        """Advisors matching the submitted search form"""
+        name = form.get('Name', [''])[0].strip().casefold()
+        city = form.get('Ort', [''])[0].strip().casefold()
+        postal_code = form.get('Postleitzahl', [''])[0].strip()
+        industries = set(form.get('Branche', []))
+
+        if not (name or city or postal_code or industries):
+            # Like the live site, an empty search returns an arbitrary selection
+            with self._lock:
+                return self._rng.sample(self.advisors, min(self.random_size, len(self.advisors)))
+
+        return [
+            advisor for advisor in self.advisors
+            if (not name or name in advisor.name)
+            and (not city or advisor.city.startswith(city))
+            and (not postal_code or advisor.postal_code.startswith(postal_code))
+            and (not industries or industries & advisor.industries)
+        ]
+
+    def result_page(self, advisors, page_size, page=1):
+        """Render one page of a result list, with a next-page link if more follow"""
+        start = (page - 1) * page_size
+        next_url = None
+        if start + page_size < len(advisors):
+            with self._lock:
+                token = str(next(self._tokens))
+                self._result_lists[token] = (advisors, page_size)
+                while len(self._result_lists) > 1000:
+                    self._result_lists.popitem(last=False)
+            next_url = f"{RESULTS_PATH}?token={token}&page={page + 1}"
+        return render_result_page([advisor.lines for advisor in advisors[start:start + page_size]], next_url)
+
+    def recorded_page(self):
+        """Next recorded result page, in rotation"""
+        with self._lock:
+            return self.recorded_pages[self.requests % len(self.recorded_pages)]
+
+    def stored_results(self, token):
+        with self._lock:
+            return self._result_lists.get(token)
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, html, status=200):
+        body = html.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        replay = self.server.replay
+        replay.delay()
+        url = urlsplit(self.path)
+
+        if url.path == START_PATH:
+            self._send(replay.start_page or render_start_page(SEARCH_PATH, replay.industries))
+        elif url.path == RESULTS_PATH:
+            query = parse_qs(url.query)
+            stored = replay.stored_results(query.get('token', [''])[0])
+            if stored is None:
+                self._send('<html><body>Sitzung abgelaufen</body></html>', 404)
+                return
+            advisors, page_size = stored
+            self._send(replay.result_page(advisors, page_size, int(query.get('page', ['1'])[0])))
+        else:
+            self._send('<html><body>Nicht gefunden</body></html>', 404)
+
+    def do_POST(self):
+        replay = self.server.replay
+        replay.delay()
+
+        if urlsplit(self.path).path != SEARCH_PATH:
+            self._send('<html><body>Nicht gefunden</body></html>', 404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'), keep_blank_values=True)
+
+        if replay.recorded_pages:
+            self._send(replay.recorded_page())
+            return
+
+        page_size = int(form.get('Anzahl', ['10'])[0] or 10)
+        self._send(replay.result_page(replay.search(form), page_size))
+
+
+def main():
+    """Run the replay server in the foreground"""
+    parser = argparse.ArgumentParser(description="Local stand-in for the DATEV kasus search")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--advisors', type=int, default=5000, help="Synthetic directory size (default: 5000)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra seconds per response")
+    parser.add_argument('--random-size', type=int, default=500,
+                        help="Results of a search without criteria (default: 500)")
+    parser.add_argument('--fixtures', help="Directory of recorded pages (start.html and result pages) to replay")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    server = ReplayServer(args.advisors, args.latency, args.jitter, args.random_size,
+                          fixtures=args.fixtures, port=args.port)
+    logger.info(f"Serving {len(server.advisors)} advisors on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
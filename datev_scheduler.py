@@ -0,0 +1,188 @@
+import math
+import logging
+
+from datev_storage import unit_key
+
+logger = logging.getLogger(__name__)
+
+
+class QueryFamily:
+    """Search units of one strategy, handed out in batches"""
+
+    def __init__(self, name, units, strategy=None):
+        self.name = name
+        self.strategy = strategy or name  # work queue name, shared by the families a strategy is split into
+        self.units = list(units)  # (criteria, variant)
+        self._position = 0
+
+    def next_batch(self, size=None):
+        """Up to size units not handed out yet, all of them if size is None"""
+        end = len(self.units) if size is None else self._position + size
+        batch = self.units[self._position:end]
+        self._position += len(batch)
+        return batch
+
+    def report(self, batch, results):
+        """SearchResults of a finished batch, by unit key"""
+        pass
+
+    def log_progress(self):
+        """Log how far the family got"""
+        logger.info(f"Query family {self.name}: {self._position} of {len(self.units)} searches handed out")
+
+
+class PlannedQueryFamily(QueryFamily):
+    """Search units drawn from a QueryPlanner, which refines them by their result counts"""
+
+    def __init__(self, name, planner, strategy=None):
+        super().__init__(name, [], strategy)
+        self.planner = planner
+
+    def next_batch(self, size=None):
+        batch = []
+        while size is None or len(batch) < size:
+            criteria = self.planner.next_query()
+            if criteria is None:
+                break
+            batch.append((criteria, None))
+        return batch
+
+    def report(self, batch, results):
+        for criteria, variant in batch:
+            result = results.get(unit_key(criteria, variant))
+            if result is not None:
+                self.planner.report(criteria, result.count, result.truncated)
+
+    def log_progress(self):
+        self.planner.log_progress()
+
+
+def run_family(family, run_units):
+    """Run a family to completion; a planned family runs a whole frontier at a time"""
+    batch = family.next_batch()
+    while batch:
+        family.report(batch, run_units(family.strategy, batch))
+        batch = family.next_batch()
+
+
+class FamilyYield:
+    """Requests spent on a query family and the new records they found"""
+
+    def __init__(self):
+        self.units = 0
+        self.requests = 0
+        self.new_records = 0
+        self.batches = 0
+        self.recent = None  # exponentially weighted new records per request
+        self.state = 'active'  # or 'exhausted', 'retired'
+        self.started = False
+
+    def as_dict(self):
+        return {
+            'units': self.units,
+            'requests': self.requests,
+            'new_records': self.new_records,
+            'yield': round(self.new_records / self.requests, 3) if self.requests else 0.0,
+            'recent_yield': round(self.recent, 3) if self.recent is not None else None,
+            'state': self.state,
+        }
+
+
+class YieldScheduler:
+    """
+    Spend searches on the query families that still find new contacts.
+
+    Families run in batches. After each batch the scheduler records how many
+    new unique records it found per request sent, smoothed over recent
+    batches. The next batch goes to the family with the best recent yield plus
+    an exploration bonus for families tried less often (UCB). A family whose
+    recent yield falls below min_yield after at least min_units searches is
+    retired; the crawl ends when every family is retired or exhausted.
+
+    Batches answered entirely from the work queue or the cache cost no
+    requests and carry no yield information, so they do not count.
+    """
+
+    def __init__(self, families, run_units, count_records, count_requests, batch_size=10, min_yield=0.05,
+                 min_units=20, smoothing=0.3, exploration=0.5):
+        self.families = list(families)
+        self.run_units = run_units  # run_units(strategy, units) -> SearchResults by unit key
+        self.count_records = count_records
+        self.count_requests = count_requests
+        self.batch_size = batch_size
+        self.min_yield = min_yield
+        self.min_units = min_units
+        self.smoothing = smoothing
+        self.exploration = exploration
+        self.stats = {family.name: FamilyYield() for family in self.families}
+
+    def run(self):
+        """Run batches until no family is left active, return the per-family yield"""
+        while True:
+            active = [family for family in self.families if self.stats[family.name].state == 'active']
+            if not active:
+                break
+
+            family = self._choose(active)
+            stats = self.stats[family.name]
+            batch = family.next_batch(self.batch_size)
+            if not batch:
+                stats.state = 'exhausted'
+                logger.info(f"Query family {family.name} exhausted: {stats.as_dict()}")
+                continue
+            if not stats.started:
+                stats.started = True
+                logger.info(f"Starting query family {family.name}")
+
+            records_before = self.count_records()
+            requests_before = self.count_requests()
+            family.report(batch, self.run_units(family.strategy, batch))
+            self._record(family, len(batch), self.count_records() - records_before,
+                         self.count_requests() - requests_before)
+
+        self.log_summary()
+        return self.summary()
+
+    def _choose(self, active):
+        """Families that have not been measured go first, in order; then the best upper confidence bound"""
+        for family in active:
+            if self.stats[family.name].recent is None:
+                return family
+
+        total = sum(self.stats[family.name].batches for family in active)
+
+        def score(family):
+            stats = self.stats[family.name]
+            return stats.recent + self.exploration * math.sqrt(math.log(total) / stats.batches)
+
+        return max(active, key=score)
+
+    def _record(self, family, units, new_records, requests):
+        stats = self.stats[family.name]
+        stats.new_records += new_records
+        if not requests:
+            return
+
+        stats.units += units
+        stats.requests += requests
+        stats.batches += 1
+        batch_yield = new_records / requests
+        if stats.recent is None:
+            stats.recent = batch_yield
+        else:
+            stats.recent += self.smoothing * (batch_yield - stats.recent)
+
+        if stats.units >= self.min_units and stats.recent < self.min_yield:
+            stats.state = 'retired'
+            logger.info(f"Retiring query family {family.name}: {stats.recent:.3f} new records per request "
+                        f"is below {self.min_yield} ({stats.as_dict()})")
+
+    def summary(self):
+        """Units, requests, new records and yield of each family"""
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def log_summary(self):
+        """Log what each family cost and found"""
+        for name, stats in self.summary().items():
+            logger.info(f"Query family {name}: {stats['units']} searches, {stats['requests']} requests, "
+                        f"{stats['new_records']} new records ({stats['yield']:.2f}/request), {stats['state']}")
@@ -0,0 +1,480 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+
+from datev_linkage import merge_records
+from datev_planner import criteria_key
+
+logger = logging.getLogger(__name__)
+
+
+def unit_key(criteria, variant=None):
+    """Key of one search; variant tells apart repeated searches with equal criteria"""
+    key = criteria_key(criteria)
+    return key if variant is None else f"{key}#{variant}"
+
+
+# Outcome of a finished search: how many records it returned and whether the site cut the list off;
+# truncated is None where that was not recorded
+SearchResult = namedtuple('SearchResult', ['count', 'truncated'])
+
+# Fields that do not describe the advisor and are left out of the content hash
+UNHASHED_FIELDS = ('unique_id', 'full_text')
+
+
+def content_hash(record):
+    """Hash of what a record says about an advisor, equal across runs if nothing changed"""
+    content = {field: value for field, value in record.items() if field not in UNHASHED_FIELDS}
+    return hashlib.sha1(json.dumps(content, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def result_set_hash(records):
+    """Hash of the records a search returned, independent of their order"""
+    digest = hashlib.sha1()
+    for entry in sorted(f"{record['unique_id']}:{content_hash(record)}" for record in records):
+        digest.update(entry.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def _add_columns(connection, table, columns):
+    """Add columns that a database written by an older version does not have yet"""
+    existing = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns:
+        if name not in existing:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _connect(path):
+    """Open a SQLite database that several threads may share behind a lock"""
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def stored_crawl(path):
+    """Searches and records held by the crawl state file at path, (0, 0) if there is none"""
+    if not os.path.exists(path):
+        return 0, 0
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        counts = []
+        for table in ('work_units', 'records'):
+            try:
+                counts.append(connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0])
+            except sqlite3.OperationalError:
+                counts.append(0)
+        return tuple(counts)
+    finally:
+        connection.close()
+
+
+class QueryCache:
+    """
+    Disk cache of search results keyed by normalized criteria.
+
+    Stores the raw result pages (compressed) and the parsed records of each
+    search. Entries older than ttl seconds are misses; once the cache grows
+    past max_bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, path='datev_cache.sqlite', ttl=7 * 24 * 3600, max_bytes=500 * 1024 * 1024, namespace=''):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.namespace = namespace  # e.g. base URL and page settings, results differ per namespace
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.connection = _connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS query_cache (
+                namespace TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                pages BLOB NOT NULL,
+                records TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                truncated INTEGER,
+                PRIMARY KEY (namespace, cache_key)
+            )
+        """)
+        _add_columns(self.connection, 'query_cache', [('truncated', 'INTEGER')])
+        self.connection.execute("CREATE INDEX IF NOT EXISTS query_cache_accessed ON query_cache (accessed)")
+        self.connection.commit()
+        self._size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM query_cache").fetchone()[0]
+
+    def get(self, criteria, variant=None):
+        """Parsed records of a cached search and whether it was truncated, or None on a miss"""
+        key = unit_key(criteria, variant)
+        now = time.time()
+
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT records, created, size, truncated FROM query_cache WHERE namespace = ? AND cache_key = ?",
+                (self.namespace, key)).fetchone()
+
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self._delete(key, row[2])
+                self.connection.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.connection.execute(
+                "UPDATE query_cache SET accessed = ? WHERE namespace = ? AND cache_key = ?",
+                (now, self.namespace, key))
+            self.connection.commit()
+            self.hits += 1
+
+        return json.loads(row[0]), None if row[3] is None else bool(row[3])
+
+    def get_pages(self, criteria, variant=None):
+        """Raw HTML of the result pages of a cached search, or None"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT pages FROM query_cache WHERE namespace = ? AND cache_key = ?",
+                (self.namespace, unit_key(criteria, variant))).fetchone()
+        return json.loads(zlib.decompress(row[0]).decode('utf-8')) if row else None
+
+    def put(self, criteria, pages, records, variant=None, truncated=None):
+        """Store the result pages and parsed records of a search"""
+        key = unit_key(criteria, variant)
+        pages_blob = zlib.compress(json.dumps(pages, ensure_ascii=False).encode('utf-8'))
+        records_json = json.dumps(records, ensure_ascii=False)
+        size = len(pages_blob) + len(records_json)
+        now = time.time()
+
+        with self._lock:
+            old = self.connection.execute(
+                "SELECT size FROM query_cache WHERE namespace = ? AND cache_key = ?",
+                (self.namespace, key)).fetchone()
+            if old is not None:
+                self._size -= old[0]
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO query_cache "
+                "(namespace, cache_key, pages, records, size, created, accessed, truncated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, pages_blob, records_json, size, now, now,
+                 None if truncated is None else int(truncated)))
+            self._size += size
+            self._evict()
+            self.connection.commit()
+
+    def _delete(self, key, size):
+        self.connection.execute(
+            "DELETE FROM query_cache WHERE namespace = ? AND cache_key = ?", (self.namespace, key))
+        self._size -= size
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits into max_bytes"""
+        if not self.max_bytes or self._size <= self.max_bytes:
+            return
+
+        evicted = 0
+        rows = self.connection.execute(
+            "SELECT namespace, cache_key, size FROM query_cache ORDER BY accessed").fetchall()
+        for namespace, key, size in rows:
+            if self._size <= self.max_bytes:
+                break
+            self.connection.execute(
+                "DELETE FROM query_cache WHERE namespace = ? AND cache_key = ?", (namespace, key))
+            self._size -= size
+            evicted += 1
+
+        logger.info(f"Query cache evicted {evicted} entries, {self._size / 1024 / 1024:.1f} MB left")
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'size_mb': round(self._size / 1024 / 1024, 2),
+        }
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self.connection.close()
+
+
+class WorkQueue:
+    """
+    Durable list of the query units of a crawl and their state.
+
+    A unit is one search of one strategy. It is pending until it starts, in
+    flight while it runs and done once its records are stored. Every state
+    change is committed right away, so after a crash a resumed crawl knows
+    exactly which searches finished and how many results they returned.
+
+    A finished unit also keeps a hash of its result set and the unique IDs it
+    returned, which a later refresh of the crawl compares against.
+    """
+
+    PENDING = 'pending'
+    IN_FLIGHT = 'in_flight'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path='datev_crawl.sqlite', resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+
+        self.connection = _connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS work_units (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                strategy TEXT NOT NULL,
+                unit_key TEXT NOT NULL,
+                criteria TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result_count INTEGER,
+                updated REAL NOT NULL,
+                result_hash TEXT,
+                stable_runs INTEGER NOT NULL DEFAULT 0,
+                skipped_runs INTEGER NOT NULL DEFAULT 0,
+                truncated INTEGER,
+                UNIQUE (strategy, unit_key)
+            )
+        """)
+        _add_columns(self.connection, 'work_units', [
+            ('result_hash', 'TEXT'),
+            ('stable_runs', 'INTEGER NOT NULL DEFAULT 0'),  # refreshes in a row that returned the same results
+            ('skipped_runs', 'INTEGER NOT NULL DEFAULT 0'),  # refreshes in a row that reused the results
+            ('truncated', 'INTEGER'),  # whether the site cut the result list off, NULL if not known
+        ])
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS unit_results (
+                strategy TEXT NOT NULL,
+                unit_key TEXT NOT NULL,
+                unique_id TEXT NOT NULL,
+                PRIMARY KEY (strategy, unit_key, unique_id)
+            ) WITHOUT ROWID
+        """)
+
+        if resume:
+            # Units that were running when the crawl stopped are simply run again
+            interrupted = self.connection.execute(
+                "UPDATE work_units SET status = ? WHERE status = ?", (self.PENDING, self.IN_FLIGHT)).rowcount
+            logger.info(f"Resuming crawl from {path}: {self.counts()}, {interrupted} interrupted units requeued")
+        else:
+            self.connection.execute("DELETE FROM work_units")
+            self.connection.execute("DELETE FROM unit_results")
+        self.connection.commit()
+
+    def enqueue(self, strategy, units):
+        """Add (criteria, variant) units as pending, units already known are left alone"""
+        now = time.time()
+        with self._lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO work_units (strategy, unit_key, criteria, status, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(strategy, unit_key(criteria, variant), json.dumps(criteria, ensure_ascii=False),
+                  self.PENDING, now) for criteria, variant in units])
+            self.connection.commit()
+
+    def result(self, strategy, criteria, variant=None):
+        """SearchResult of a finished unit, None if it has not finished"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT result_count, truncated FROM work_units WHERE strategy = ? AND unit_key = ? AND status = ?",
+                (strategy, unit_key(criteria, variant), self.DONE)).fetchone()
+        if row is None:
+            return None
+        return SearchResult(row[0], None if row[1] is None else bool(row[1]))
+
+    def start(self, strategy, criteria, variant=None):
+        """Mark a unit as in flight"""
+        self._set_status(strategy, criteria, variant, self.IN_FLIGHT, attempts=1)
+
+    def complete(self, strategy, criteria, result_count, variant=None, results=None, truncated=None):
+        """Mark a unit as done, its records must already be stored; results are hashed for later refreshes"""
+        key = unit_key(criteria, variant)
+        result_hash = None
+        if results is not None:
+            result_hash = result_set_hash(results)
+            with self._lock:
+                self.connection.execute(
+                    "DELETE FROM unit_results WHERE strategy = ? AND unit_key = ?", (strategy, key))
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO unit_results VALUES (?, ?, ?)",
+                    [(strategy, key, result['unique_id']) for result in results])
+        self._set_status(strategy, criteria, variant, self.DONE, result_count=result_count, result_hash=result_hash,
+                         truncated=truncated)
+
+    def carry_over(self, strategy, criteria, variant, previous):
+        """Mark a unit as done with the results of a previous crawl, without searching it"""
+        self._set_status(strategy, criteria, variant, self.DONE, result_count=previous.result_count,
+                         result_hash=previous.result_hash, stable_runs=previous.stable_runs,
+                         skipped_runs=previous.skipped_runs + 1, truncated=previous.truncated)
+
+    def fail(self, strategy, criteria, variant=None):
+        """Mark a unit as failed, a resumed crawl tries it again"""
+        self._set_status(strategy, criteria, variant, self.FAILED)
+
+    def _set_status(self, strategy, criteria, variant, status, attempts=0, result_count=None, result_hash=None,
+                    stable_runs=0, skipped_runs=0, truncated=None):
+        with self._lock:
+            self.connection.execute("""
+                INSERT INTO work_units (strategy, unit_key, criteria, status, attempts, result_count, updated,
+                                        result_hash, stable_runs, skipped_runs, truncated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (strategy, unit_key) DO UPDATE SET
+                    status = excluded.status,
+                    attempts = attempts + excluded.attempts,
+                    result_count = excluded.result_count,
+                    updated = excluded.updated,
+                    result_hash = excluded.result_hash,
+                    stable_runs = excluded.stable_runs,
+                    skipped_runs = excluded.skipped_runs,
+                    truncated = excluded.truncated
+            """, (strategy, unit_key(criteria, variant), json.dumps(criteria, ensure_ascii=False), status,
+                  attempts, result_count, time.time(), result_hash, stable_runs, skipped_runs,
+                  None if truncated is None else int(truncated)))
+            self.connection.commit()
+
+    def counts(self, strategy=None):
+        """Number of units per state, for one strategy or the whole crawl"""
+        query = "SELECT status, COUNT(*) FROM work_units"
+        params = ()
+        if strategy:
+            query += " WHERE strategy = ?"
+            params = (strategy,)
+        with self._lock:
+            return dict(self.connection.execute(query + " GROUP BY status", params).fetchall())
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self.connection.close()
+
+
+class RecordStore:
+    """
+    Store of unique advisor records, in the order they were found.
+
+    Records are written as soon as a search returns them. A record whose
+    unique_id is stored already is merged into the stored one, which keeps
+    its fields and takes the ones it lacked. A checkpoint only has to look
+    at what was added since the previous one, and exports read the records
+    back in the order they were found. Each record is stored with its
+    content hash, so a refresh can tell unchanged records apart without
+    comparing fields.
+    """
+
+    def __init__(self, path='datev_crawl.sqlite', resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+
+        self.connection = _connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                unique_id TEXT NOT NULL UNIQUE,
+                record TEXT NOT NULL,
+                found REAL NOT NULL,
+                content_hash TEXT
+            )
+        """)
+        _add_columns(self.connection, 'records', [('content_hash', 'TEXT')])
+        if not resume:
+            self.connection.execute("DELETE FROM records")
+        self.connection.commit()
+        self._checkpoint_seq = self._last_seq()
+
+    def _last_seq(self):
+        return self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM records").fetchone()[0]
+
+    def add(self, records):
+        """Append new records and merge repeats into the stored ones, return how many were new"""
+        now = time.time()
+        with self._lock:
+            stored = self._stored({record['unique_id'] for record in records})
+            new, merged = {}, {}
+            for record in records:
+                unique_id = record['unique_id']
+                if unique_id in new:
+                    new[unique_id] = merge_records([new[unique_id], record])
+                elif unique_id in stored:
+                    current = merged.get(unique_id, stored[unique_id])
+                    update = merge_records([current, record])
+                    # Most repeats add nothing, those are not written again
+                    if update != current:
+                        merged[unique_id] = update
+                else:
+                    new[unique_id] = record
+
+            self.connection.executemany(
+                "INSERT INTO records (unique_id, record, found, content_hash) VALUES (?, ?, ?, ?)",
+                [(unique_id, json.dumps(record, ensure_ascii=False), now, content_hash(record))
+                 for unique_id, record in new.items()])
+            self.connection.executemany(
+                "UPDATE records SET record = ?, content_hash = ? WHERE unique_id = ?",
+                [(json.dumps(record, ensure_ascii=False), content_hash(record), unique_id)
+                 for unique_id, record in merged.items()])
+            self.connection.commit()
+            return len(new)
+
+    def _stored(self, unique_ids, batch_size=500):
+        """Stored records by unique_id, for those of unique_ids that are stored"""
+        unique_ids = list(unique_ids)
+        stored = {}
+        for start in range(0, len(unique_ids), batch_size):
+            batch = unique_ids[start:start + batch_size]
+            rows = self.connection.execute(
+                f"SELECT unique_id, record FROM records WHERE unique_id IN ({', '.join('?' * len(batch))})", batch)
+            stored.update((unique_id, json.loads(record)) for unique_id, record in rows)
+        return stored
+
+    def checkpoint(self):
+        """Flush the write-ahead log, return the number of records added since the last checkpoint"""
+        with self._lock:
+            self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            last_seq = self._last_seq()
+            new_records = self.connection.execute(
+                "SELECT COUNT(*) FROM records WHERE seq > ?", (self._checkpoint_seq,)).fetchone()[0]
+            self._checkpoint_seq = last_seq
+        return new_records
+
+    def unique_ids(self):
+        """Unique IDs of all stored records"""
+        with self._lock:
+            return [row[0] for row in self.connection.execute("SELECT unique_id FROM records")]
+
+    def records(self, batch_size=1000):
+        """Yield all records in the order they were found, reading batch_size rows at a time"""
+        last_seq = 0
+        while True:
+            with self._lock:
+                rows = self.connection.execute(
+                    "SELECT seq, record FROM records WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (last_seq, batch_size)).fetchall()
+            if not rows:
+                return
+            for seq, record in rows:
+                yield json.loads(record)
+            last_seq = rows[-1][0]
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self.connection.close()
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The scraper modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datev_complete_scraper import CompleteDATEVScraper  # noqa: E402
+from datev_replay_server import ReplayServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    """Replay server with a synthetic directory of 1500 advisors"""
+    server = ReplayServer(1500, random_size=100).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_scraper(server, tmp_path):
+    """Factory of unthrottled http scrapers crawling the replay server without a cache, closed after the test"""
+    scrapers = []
+
+    def make(state='crawl.sqlite', **options):
+        options = dict({'backend': 'http', 'base_url': server.url, 'min_interval': 0, 'jitter': 0,
+                        'cache_path': None, 'state_path': str(tmp_path / state)}, **options)
+        scraper = CompleteDATEVScraper(**options)
+        scrapers.append(scraper)
+        return scraper
+
+    yield make
+    for scraper in scrapers:
+        scraper.close()
@@ -0,0 +1,90 @@
+import csv
+import gzip
+
+import pytest
+from openpyxl import load_workbook
+
+from datev_export import EXPORT_COLUMNS, compress_text, decompress_text, export_format, export_records
+
+
+def _records(count=7):
+    return [{'name': f"Jürgen Müller {i}", 'city': 'Köln', 'postal_code': f"{50667 + i}", 'email': '',
+             'full_text': f"Herrn\nJürgen Müller {i}\nSteuerberater"} for i in range(count)]
+
+
+def _expected(records, full_text):
+    rows = [[record.get(column, '') for column in EXPORT_COLUMNS] for record in records]
+    if full_text == 'keep':
+        return [row + [record['full_text']] for row, record in zip(rows, records)]
+    if full_text == 'compress':
+        return [row + [compress_text(record['full_text'])] for row, record in zip(rows, records)]
+    return rows
+
+
+def _read_csv(path, opener=open):
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        return list(csv.reader(f))
+
+
+def _read_xlsx(path):
+    workbook = load_workbook(path, read_only=True)
+    # Empty cells come back as None
+    rows = [['' if value is None else value for value in row] for row in workbook['contacts'].values]
+    workbook.close()
+    return rows
+
+
+@pytest.mark.parametrize('filename, read', [
+    ('contacts.csv', _read_csv),
+    ('contacts.CSV.gz', lambda path: _read_csv(path, gzip.open)),
+    ('contacts.xlsx', _read_xlsx),
+])
+@pytest.mark.parametrize('full_text, last_column', [('keep', 'full_text'), ('drop', None),
+                                                    ('compress', 'full_text_zlib')])
+def test_export_round_trip(tmp_path, filename, read, full_text, last_column):
+    records = _records()
+    path = str(tmp_path / filename)
+
+    stats = export_records(iter(records), path, full_text=full_text, chunk_size=3)
+
+    header, *rows = read(path)
+    assert header == EXPORT_COLUMNS + ([last_column] if last_column else [])
+    assert rows == _expected(records, full_text)
+    assert stats['rows'] == len(records)
+
+
+def test_compressed_full_text_decompresses(tmp_path):
+    records = _records(2)
+    path = str(tmp_path / 'contacts.csv')
+    export_records(records, path, full_text='compress')
+
+    rows = _read_csv(path)[1:]
+    assert [decompress_text(row[-1]) for row in rows] == [record['full_text'] for record in records]
+
+
+@pytest.mark.parametrize('text', ['', 'Herrn\nDr. Jürgen Müller\nSteuerberater', 'ß€' * 1000])
+def test_compress_text_round_trip(text):
+    value = compress_text(text)
+
+    assert value.isascii() and ',' not in value and '\n' not in value
+    assert decompress_text(value) == text
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('contacts.csv', 'csv'), ('contacts.csv.gz', 'csv'), ('Contacts.XLSX', 'xlsx'), ('out/contacts.parquet', 'parquet'),
+])
+def test_export_format(filename, expected):
+    assert export_format(filename) == expected
+
+
+@pytest.mark.parametrize('filename', ['contacts.xlsx.gz', 'contacts.parquet.gz', 'contacts.json', 'contacts'])
+def test_unsupported_export_files_are_refused(tmp_path, filename):
+    path = tmp_path / filename
+    with pytest.raises(ValueError):
+        export_records(_records(), str(path))
+    assert not path.exists()
+
+
+def test_unknown_full_text_mode_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        export_records(_records(), str(tmp_path / 'contacts.csv'), full_text='zip')
@@ -0,0 +1,93 @@
+import pytest
+
+from datev_linkage import (RecordLinker, cologne_phonetic, link_records, merge_records, normalize_address,
+                           normalize_email, normalize_name, normalize_phone, profile)
+
+
+def advisor(name, address='Hauptstraße 12', postal_code='10115', **fields):
+    return dict({'name': name, 'address': address, 'postal_code': postal_code, 'city': 'Berlin'}, **fields)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('Dr. Jürgen Müller', 'juergen mueller'),
+    ('Herrn Dipl.-Kfm. Jürgen Müller, StB', 'juergen mueller'),
+    ('Prof. Dr. rer. pol. Anna Groß LL.M.', 'anna gross'),
+    ('  Renée   Weiß ', 'renee weiss'),
+])
+def test_normalize_name(name, expected):
+    assert normalize_name(name) == expected
+
+
+@pytest.mark.parametrize('address', ['Hauptstraße 12a', 'Hauptstr. 12 a', 'HAUPTSTRASSE 12A', 'Hauptstr 12a'])
+def test_normalize_address(address):
+    assert normalize_address(address) == 'hauptstr 12a'
+
+
+@pytest.mark.parametrize('phone', ['030 123456', '+49 (0)30 123456', '0049 30 123456', '(030) 12 34 56'])
+def test_normalize_phone(phone):
+    assert normalize_phone(phone) == '030123456'
+
+
+def test_normalize_email():
+    assert normalize_email(' mailto:Info@Kanzlei-Mueller.DE ') == 'info@kanzlei-mueller.de'
+
+
+@pytest.mark.parametrize('word, expected', [
+    ('Müller-Lüdenscheidt', '65752682'),
+    ('Breschnew', '17863'),
+    ('Wikipedia', '3412'),
+    ('Meyer', '67'),
+    ('Maier', '67'),
+    ('Mayr', '67'),
+    ('Schmidt', '862'),
+    ('Schmitt', '862'),
+    ('', ''),
+])
+def test_cologne_phonetic(word, expected):
+    assert cologne_phonetic(word) == expected
+
+
+def test_spelling_variants_share_a_block():
+    linker = RecordLinker()
+    keys = [linker.blocking_keys(profile(advisor(name))) for name in ('Hans Meyer', 'Hans Maier', 'Hans Mayr')]
+    assert keys[0] == keys[1] == keys[2] == [('postal', '10115', '67')]
+
+
+def test_phone_and_email_are_blocking_keys():
+    fields = profile(advisor('Hans Meyer', phone='+49 30 123', email='mailto:hm@example.de'))
+    assert RecordLinker().blocking_keys(fields) == [
+        ('postal', '10115', '67'), ('phone', '030123'), ('email', 'hm@example.de')]
+
+
+def test_record_without_name_blocks_by_company():
+    fields = profile(advisor('', company='Meyer & Partner mbB'))
+    assert RecordLinker().blocking_keys(fields) == [('postal', '10115', cologne_phonetic('mbb'))]
+
+
+def test_link_records_merges_spelling_variants():
+    records = [
+        advisor('Dr. Hans Meyer', phone='030 123'),
+        advisor('Hans Meier', 'Hauptstr. 12', email='hm@example.de'),
+        advisor('Erika Schulz'),
+    ]
+    linked = list(link_records(lambda: iter(records)))
+    assert linked == [dict(records[0], email='hm@example.de'), records[2]]
+
+
+def test_link_records_keeps_colleagues_apart():
+    # Same office, phone and address, different people
+    records = [advisor('Hans Meyer', phone='030 123'), advisor('Erika Meyer', phone='030 123')]
+    assert list(link_records(lambda: iter(records))) == records
+
+
+def test_link_records_keeps_neighbours_apart():
+    records = [advisor('Hans Meyer'), advisor('Hans Meyer', 'Hauptstraße 14')]
+    assert len(list(link_records(lambda: iter(records)))) == 2
+
+
+def test_merge_records_keeps_the_first_and_fills_empty_fields():
+    first = advisor('Hans Meyer', phone='030 123', email='')
+    second = advisor('Hans Meier', phone='030 999', email='hm@example.de', website='example.de')
+    merged = merge_records([first, second])
+    assert merged == dict(first, email='hm@example.de', website='example.de')
+    assert first['email'] == ''
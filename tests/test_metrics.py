@@ -0,0 +1,120 @@
+import json
+from urllib.request import urlopen
+
+import pytest
+
+from datev_metrics import BUCKETS, CrawlMetrics, Histogram, MetricsServer, PhaseTimer, is_timeout
+
+
+def test_histogram_counts_durations_per_bucket():
+    histogram = Histogram()
+    for seconds in (0.002, 0.002, 0.3, 200.0):
+        histogram.observe(seconds)
+
+    assert histogram.count == 4
+    assert histogram.total == pytest.approx(200.304)
+    assert histogram.max == 200.0
+    assert histogram.buckets[BUCKETS.index(0.005)] == 2
+    assert histogram.buckets[BUCKETS.index(0.5)] == 1
+    assert histogram.buckets[-1] == 1
+    cumulative = dict(histogram.cumulative())
+    assert cumulative[0.001] == 0
+    assert cumulative[0.005] == 2
+    assert cumulative[120.0] == 3
+    assert cumulative[float('inf')] == 4
+
+
+def test_histogram_quantiles_are_bucket_bounds_capped_at_the_maximum():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) == 0.0
+    for _ in range(9):
+        histogram.observe(0.02)
+    histogram.observe(3.0)
+
+    assert histogram.quantile(0.5) == 0.025
+    assert histogram.quantile(0.9) == 0.025
+    assert histogram.quantile(0.99) == 3.0
+    stats = histogram.as_dict()
+    assert stats['p50'] == 0.025
+    assert stats['mean'] == pytest.approx(0.318)
+    assert stats['buckets']['+Inf'] == 10
+
+
+def test_is_timeout_follows_the_exception_chain():
+    try:
+        try:
+            raise TimeoutError("read timed out")
+        except TimeoutError as e:
+            raise RuntimeError("search failed") from e
+    except RuntimeError as e:
+        error = e
+
+    assert is_timeout(error)
+    assert not is_timeout(ValueError("bad page"))
+
+
+def _metrics():
+    timer = PhaseTimer()
+    timer.record('fetch', 0.2)
+    metrics = CrawlMetrics(timer)
+    metrics.search('city', 0.5, results=10, new_records=4)
+    metrics.search('city', 1.5, results=6, new_records=0, cached=True)
+    metrics.failure('city', TimeoutError("read timed out"))
+    metrics.failure('name', ValueError("bad page"))
+    metrics.render_timeout('name', 2)
+    metrics.add_source('requests', lambda: 42)
+    metrics.add_source('broken', lambda: 1 / 0)
+    return metrics
+
+
+def test_snapshot_counts_searches_failures_and_sources():
+    snapshot = _metrics().snapshot()
+
+    city = snapshot['strategies']['city']
+    assert (city['searches'], city['cached'], city['results'], city['new_records']) == (2, 1, 16, 4)
+    assert (city['duplicates'], city['new_share']) == (12, 0.25)
+    assert (city['failures'], city['timeouts'], city['errors']) == (1, 1, {'TimeoutError': 1})
+    name = snapshot['strategies']['name']
+    assert (name['failures'], name['timeouts'], name['render_timeouts']) == (1, 0, 2)
+    assert snapshot['searches'] == 2
+    assert snapshot['new_records'] == 4
+    assert snapshot['phases']['fetch']['count'] == 1
+    assert snapshot['requests'] == 42
+    assert 'error' in snapshot['broken']
+    # The run report is plain JSON
+    json.dumps(snapshot)
+
+
+def test_prometheus_output():
+    lines = _metrics().prometheus().splitlines()
+
+    assert '# TYPE datev_searches_total counter' in lines
+    assert 'datev_searches_total{strategy="city"} 2' in lines
+    assert 'datev_search_failures_total{strategy="name",type="ValueError"} 1' in lines
+    assert 'datev_search_timeouts_total{strategy="city"} 1' in lines
+    assert 'datev_render_timeouts_total{strategy="name"} 2' in lines
+    assert 'datev_records_total{strategy="city",kind="duplicate"} 12' in lines
+    assert '# TYPE datev_search_seconds histogram' in lines
+    assert 'datev_search_seconds_bucket{strategy="city",le="0.5"} 1' in lines
+    assert 'datev_search_seconds_bucket{strategy="city",le="+Inf"} 2' in lines
+    assert 'datev_search_seconds_count{strategy="city"} 2' in lines
+    assert 'datev_phase_seconds_count{phase="fetch"} 1' in lines
+    assert 'datev_requests 42' in lines
+    # Every sample line is a name with optional labels and a number
+    for line in lines:
+        if not line.startswith('#'):
+            float(line.rsplit(' ', 1)[1])
+
+
+def test_metrics_server_serves_both_formats():
+    server = MetricsServer(_metrics(), port=0).start()
+    try:
+        with urlopen(server.url) as response:
+            text = response.read().decode('utf-8')
+        with urlopen(server.url + '.json') as response:
+            snapshot = json.load(response)
+    finally:
+        server.stop()
+
+    assert 'datev_searches_total{strategy="city"} 2' in text
+    assert snapshot['strategies']['city']['searches'] == 2
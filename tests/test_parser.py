@@ -0,0 +1,150 @@
+import pytest
+
+from datev_linkage import identity_key
+from datev_parser import (RECORD_FIELDS, extract_result_blocks, link_fields, parse_advisor_block,
+                          parse_advisor_blocks)
+
+MUELLER = ['Herrn', 'Dr. Jürgen Müller', 'Steuerberater', 'Hauptstraße 12', '10115 Berlin']
+WEISS = ['Frau', 'Anna Weiß', 'Wirtschaftsprüferin', 'Ringstraße 3', '50667 Köln']
+
+
+def _entry(lines, tag='div', cls='treffer'):
+    return f'<{tag} class="{cls}">' + ''.join(f'<p>{line}</p>' for line in lines) + f'</{tag}>'
+
+
+def test_single_result_counts_with_a_result_class():
+    html = f'<html><body><h1>Suchergebnis</h1>{_entry(MUELLER)}<div class="footer">Impressum</div></body></html>'
+
+    assert [block.lines for block in extract_result_blocks(html)] == [MUELLER]
+
+
+def test_single_entry_without_a_result_class_is_not_a_result_list():
+    html = f'<html><body>{_entry(MUELLER, cls="box")}</body></html>'
+
+    assert extract_result_blocks(html) == []
+
+
+def test_table_rows():
+    rows = ''.join(
+        '<tr>' + ''.join(f'<td>{line}</td>' for line in lines) + '</tr>' for lines in (MUELLER, WEISS))
+    html = f'<html><body><table><thead><tr><th>Name</th></tr></thead><tbody>{rows}</tbody></table></body></html>'
+
+    assert [block.lines for block in extract_result_blocks(html)] == [MUELLER, WEISS]
+
+
+def test_list_items():
+    items = ''.join(
+        '<li>' + '<br>'.join(lines) + '</li>' for lines in (MUELLER, WEISS))
+    html = f'<html><body><ul class="nav"><li>Start</li><li>Suche</li></ul><ol>{items}</ol></body></html>'
+
+    assert [block.lines for block in extract_result_blocks(html)] == [MUELLER, WEISS]
+
+
+def test_results_below_the_search_form():
+    form = (
+        '<form action="/kasus/Suche" method="post">'
+        '<div class="field"><label>Name</label><input name="Name"></div>'
+        '<div class="field"><label>Beruf</label><select name="Beruf">'
+        '<option>Steuerberater</option><option>Wirtschaftsprüfer</option><option>Steuerbevollmächtigte</option>'
+        '</select></div>'
+        '<div class="field"><label>Ort</label><input name="Ort"></div>'
+        '</form>'
+    )
+    html = f'<html><body>{form}<div class="ergebnisliste">{_entry(MUELLER)}{_entry(WEISS)}</div></body></html>'
+
+    assert [block.lines for block in extract_result_blocks(html)] == [MUELLER, WEISS]
+
+
+@pytest.mark.parametrize('html', [
+    '',
+    '<html><body><h1>Suchergebnis</h1><p>Es wurden keine Treffer gefunden.</p></body></html>',
+    '<html><body>Herrn<br>Dr. Jürgen Müller<br>Steuerberater<br>Hauptstraße 12</body></html>',
+    '<html><body><div><p>Steuerberater</p><p>Wirtschaftsprüfer</p></div></body></html>',
+])
+def test_pages_without_result_structure(html):
+    assert extract_result_blocks(html) == []
+
+
+def test_links_of_an_entry():
+    lines = ''.join(f'<p>{line}</p>' for line in MUELLER)
+    links = ('<a href="mailto:info@mueller-stb.de?subject=Anfrage">E-Mail</a>'
+             '<a href="tel:+4930123456">Anrufen</a>'
+             '<a href="https://www.mueller-stb.de">Website</a>')
+    html = f'<html><body><div class="treffer">{lines}{links}</div></body></html>'
+
+    block, = extract_result_blocks(html)
+
+    assert link_fields(block.links) == {
+        'email': 'info@mueller-stb.de', 'phone': '+4930123456', 'website': 'https://www.mueller-stb.de'}
+
+
+def test_link_fields_keep_the_first_of_each_kind_and_skip_site_links():
+    links = [' MAILTO:a@kanzlei.de', 'mailto:b@kanzlei.de', 'https://www.datev.de/kasus/Profil?id=1',
+             '/kasus/Suche', 'http://kanzlei.de', 'https://other.de']
+
+    assert link_fields(links) == {'email': 'a@kanzlei.de', 'website': 'http://kanzlei.de'}
+    assert link_fields([]) == {}
+
+
+ENTRY = ['Herrn', 'Dr. Jürgen Müller', 'Steuerberater', 'Müller & Partner PartG', 'Hauptstraße 12', '10115 Berlin',
+         'Tel.: 030 123456', 'Fax: 030 123457', 'Email: info@mueller-stb.de',
+         'Zuständige Berufskammer: Steuerberaterkammer Berlin']
+
+
+def test_parse_advisor_block():
+    record = parse_advisor_block(ENTRY)
+
+    assert record.to_dict() == {
+        'title': 'Herrn', 'name': 'Dr. Jürgen Müller', 'profession': 'Steuerberater',
+        'company': 'Müller & Partner PartG', 'address': 'Hauptstraße 12', 'city': 'Berlin', 'postal_code': '10115',
+        'phone': '030 123456', 'fax': '030 123457', 'mobile': '', 'email': 'info@mueller-stb.de', 'website': '',
+        'chamber': 'Steuerberaterkammer Berlin', 'unique_id': identity_key('Dr. Jürgen Müller', 'Hauptstraße 12'),
+        'full_text': '\n'.join(ENTRY)}
+
+
+def test_chamber_line_is_not_a_profession():
+    # "Steuerberaterkammer" contains "Steuerberater", taken as the profession it would make the line above a name
+    assert parse_advisor_block(['Frau', 'Anna Weiß', 'Zuständige Berufskammer: Steuerberaterkammer Köln',
+                                'Ringstraße 3']) is None
+
+    record = parse_advisor_block(['Anna Weiß', 'Steuerberaterin', 'Steuerberaterkammer Köln'])
+    assert (record.name, record.profession, record.chamber) == ('Anna Weiß', 'Steuerberaterin',
+                                                               'Steuerberaterkammer Köln')
+
+
+def test_company_entry_goes_by_the_company():
+    record = parse_advisor_block(['Treuhand Nord GmbH', 'Steuerberatungsgesellschaft', 'Hafenstraße 7',
+                                  '20457 Hamburg'])
+
+    assert record.name == ''
+    assert record.company == 'Treuhand Nord GmbH'
+    assert record.unique_id == identity_key('Treuhand Nord GmbH', 'Hafenstraße 7')
+
+
+def test_text_and_lines_parse_alike():
+    text = '\n  '.join(ENTRY) + '\n\n'
+
+    from_text = parse_advisor_block(text).to_dict()
+    from_lines = parse_advisor_block(ENTRY).to_dict()
+
+    assert from_text.pop('full_text') == text
+    assert from_lines.pop('full_text') == '\n'.join(ENTRY)
+    assert from_text == from_lines
+
+
+def test_full_text_can_be_dropped():
+    assert parse_advisor_block(ENTRY, keep_full_text=False).full_text == ''
+    assert [record.full_text for record in parse_advisor_blocks([ENTRY, ENTRY[:2]], keep_full_text=False)] == ['']
+
+
+@pytest.mark.parametrize('block', [
+    [],
+    ['Herrn', 'Dr. Jürgen Müller'],
+    ['Hauptstraße 12', '10115 Berlin', 'Tel.: 030 1'],
+])
+def test_entries_without_enough_lines_or_a_name_are_skipped(block):
+    assert parse_advisor_block(block) is None
+
+
+def test_record_fields_are_in_export_order():
+    assert list(parse_advisor_block(ENTRY).to_dict()) == list(RECORD_FIELDS)
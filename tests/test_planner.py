@@ -0,0 +1,92 @@
+import pytest
+
+from datev_planner import (QueryPlanner, combine_criteria, criteria_key, normalize_criteria, postal_prefixes,
+                           refine_by_industry, refine_postal_code)
+
+
+def test_refine_postal_code():
+    assert refine_postal_code({'postal_code': '104', 'industries': ['Ärzte']}) == [
+        {'postal_code': f"104{digit}", 'industries': ['Ärzte']} for digit in range(10)]
+    assert refine_postal_code({'postal_code': '10115'}) == []
+    assert refine_postal_code({'city': 'Berlin'}) == []
+
+
+def test_refine_by_industry():
+    refine = refine_by_industry(['Ärzte', 'Apotheken'])
+
+    assert refine({'postal_code': '10115'}) == [{'postal_code': '10115', 'industries': ['Ärzte']},
+                                                {'postal_code': '10115', 'industries': ['Apotheken']}]
+    assert refine({'postal_code': '10115', 'industries': ['Ärzte']}) == []
+
+
+def test_criteria_keys_ignore_empty_fields_and_order():
+    assert normalize_criteria({'name': ' Müller ', 'city': '', 'industries': ['b', ' a', 'b', '']}) == {
+        'name': 'Müller', 'industries': ['a', 'b']}
+    assert criteria_key({'industries': ['b', 'a'], 'city': 'Köln'}) == criteria_key({'city': 'Köln ',
+                                                                                     'industries': ('a', 'b')})
+    assert combine_criteria([{'postal_code': '10'}, {'postal_code': '20'}], [{'industries': ['Ärzte']}]) == [
+        {'postal_code': '10', 'industries': ['Ärzte']}, {'postal_code': '20', 'industries': ['Ärzte']}]
+    assert postal_prefixes(1) == [str(digit) for digit in range(1, 10)]
+    assert len(postal_prefixes(2)) == 99
+
+
+def test_truncated_query_is_replaced_depth_first():
+    planner = QueryPlanner([{'postal_code': '1'}, {'postal_code': '2'}], cap=50, log_every=0)
+
+    first = planner.next_query()
+    children = planner.report(first, 50, truncated=True)
+
+    assert children == refine_postal_code(first)
+    assert [planner.next_query() for _ in range(2)] == [{'postal_code': '10'}, {'postal_code': '11'}]
+    assert planner.progress() == {'queries': 1, 'frontier': 9, 'refined': 1, 'coverage': 0.0, 'truncated': 0.0}
+
+
+def test_cap_decides_when_truncation_is_unknown():
+    planner = QueryPlanner([{'postal_code': '1'}, {'postal_code': '2'}], cap=50, log_every=0)
+
+    assert planner.report(planner.next_query(), 49) == []
+    assert len(planner.report(planner.next_query(), 50)) == 10
+    # An explicit answer wins over the count
+    planner = QueryPlanner([{'postal_code': '1'}], cap=50, log_every=0)
+    assert planner.report(planner.next_query(), 80, truncated=False) == []
+
+
+def test_coverage_weights_split_between_children():
+    planner = QueryPlanner([{'postal_code': '1'}, {'postal_code': '2'}], cap=50, log_every=0)
+
+    planner.report(planner.next_query(), 0, truncated=True)  # "1" into "10".."19", 0.05 each
+    planner.report(planner.next_query(), 10, truncated=False)  # "10"
+    assert planner.progress()['coverage'] == pytest.approx(0.05)
+
+    for criteria in planner:
+        planner.report(criteria, 10, truncated=False)
+    assert planner.progress() == {'queries': 12, 'frontier': 0, 'refined': 1, 'coverage': 1.0, 'truncated': 0.0}
+
+
+def test_unrefinable_truncated_query_counts_as_truncated():
+    planner = QueryPlanner([{'postal_code': '10115'}, {'postal_code': '2'}], cap=50, log_every=0)
+
+    assert planner.report(planner.next_query(), 50, truncated=True) == []
+    planner.report(planner.next_query(), 10)
+
+    assert planner.progress()['coverage'] == 0.5
+    assert planner.progress()['truncated'] == 0.5
+    assert planner.next_query() is None
+
+
+def test_refiners_are_tried_in_order():
+    planner = QueryPlanner([{'postal_code': '10115'}], refiners=[refine_postal_code, refine_by_industry(['Ärzte'])],
+                           log_every=0)
+
+    assert planner.report(planner.next_query(), 50, truncated=True) == [
+        {'postal_code': '10115', 'industries': ['Ärzte']}]
+
+
+def test_reports_of_unplanned_queries_have_no_weight():
+    planner = QueryPlanner([{'postal_code': '1'}], log_every=0)
+
+    planner.report({'postal_code': '9'}, 10, truncated=False)
+
+    assert planner.progress()['queries'] == 1
+    assert planner.progress()['coverage'] == 0.0
+    assert list(planner) == [{'postal_code': '1'}]
@@ -0,0 +1,188 @@
+import time
+import threading
+
+import pytest
+
+from datev_pipeline import CrawlPipeline
+from datev_storage import unit_key
+
+
+def _crawl(scraper):
+    """Crawl to the end, return the number found, the stored records and the failed searches"""
+    found = scraper.get_all_contacts_comprehensive()
+    return found, list(scraper.contact_data), scraper.work_queue.counts().get('failed', 0)
+
+
+@pytest.mark.parametrize('pipelined, workers', [(False, 1), (True, 2)])
+def test_crawl_finds_every_advisor(server, make_scraper, pipelined, workers):
+    found, records, failed = _crawl(make_scraper(pipelined=pipelined, workers=workers))
+
+    assert found == len(server.advisors)
+    assert len({record['unique_id'] for record in records}) == len(server.advisors)
+    assert failed == 0
+
+
+def test_crawl_finds_every_advisor_when_the_site_lists_some_twice(server, make_scraper):
+    search = server.search
+
+    def search_with_repeats(form):
+        # Every third advisor is listed again right after itself, so full pages hold fewer distinct records
+        advisors = []
+        for i, advisor in enumerate(search(form)):
+            advisors.extend([advisor, advisor] if i % 3 == 0 else [advisor])
+        return advisors
+
+    server.search = search_with_repeats
+    # Two pages still hold the busiest postal code and industry searches, the narrowest the planner can go
+    found, records, failed = _crawl(make_scraper(page_size=25, max_pages=2))
+
+    assert found == len(server.advisors)
+    assert len({record['unique_id'] for record in records}) == len(server.advisors)
+    assert failed == 0
+
+
+def test_adaptive_schedule_measures_postal_regions_apart(server, make_scraper):
+    scraper = make_scraper(schedule='adaptive', min_yield=0)
+    found, records, failed = _crawl(scraper)
+
+    assert found == len(server.advisors)
+    assert len({record['unique_id'] for record in records}) == len(server.advisors)
+    assert failed == 0
+    assert {f"postal_code_{digit}" for digit in '123456789'} <= set(scraper.family_stats)
+
+
+def test_adaptive_schedule_reports_family_yield_while_it_runs(make_scraper):
+    scraper = make_scraper(schedule='adaptive', min_yield=0)
+    run_units = scraper._run_units
+    live = []
+
+    def watched_run_units(strategy, units):
+        live.append(scraper.metrics.snapshot()['families'])
+        return run_units(strategy, units)
+
+    scraper._run_units = watched_run_units
+    scraper.get_all_contacts_comprehensive()
+
+    assert live[0]['random']['requests'] == 0
+    assert live[-1]['random']['requests'] > 0
+
+
+def test_pipeline_fails_a_search_whose_stage_raises(make_scraper):
+    scraper = make_scraper(pipelined=True)
+    extract = scraper._extract_page_results
+    calls = []
+
+    def flaky_extract(html):
+        calls.append(html)
+        if len(calls) == 1:
+            raise ValueError("unparsable page")
+        return extract(html)
+
+    scraper._extract_page_results = flaky_extract
+    # Returns instead of waiting for the failed search forever
+    _, _, failed = _crawl(scraper)
+
+    assert failed == 1
+
+
+class _FailingAfterFirstPage:
+    """Fetcher that fails each search once, after handing on its first page"""
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self.searches = []
+        self.render_timeouts = 0
+
+    def fetch_pages(self, criteria, max_pages=1):
+        self.searches.append(criteria)
+        for html in self.fetcher.fetch_pages(criteria, max_pages):
+            yield html
+            if self.searches.count(criteria) == 1:
+                raise ConnectionError("connection reset")
+
+    def has_next_page(self):
+        return self.fetcher.has_next_page()
+
+    def restart(self):
+        pass
+
+
+def test_pipeline_retries_only_searches_with_criteria(make_scraper):
+    scraper = make_scraper()
+    fetcher = _FailingAfterFirstPage(scraper.fetcher)
+    pipeline = CrawlPipeline(scraper, fetchers=[fetcher]).start()
+    try:
+        counts = pipeline.run('test', [({}, 0), ({'postal_code': '1'}, None)])
+    finally:
+        pipeline.stop()
+
+    # The empty search is not continued with pages of another random selection
+    assert fetcher.searches == [{}, {'postal_code': '1'}, {'postal_code': '1'}]
+    assert list(counts) == [unit_key({'postal_code': '1'}, None)]
+    assert counts[unit_key({'postal_code': '1'}, None)].count > 0
+
+
+def test_interrupted_refresh_is_still_a_complete_baseline(make_scraper, tmp_path):
+    found, _, _ = _crawl(make_scraper('previous.sqlite'))
+
+    refresh = make_scraper('refresh.sqlite', refresh_from=str(tmp_path / 'previous.sqlite'),
+                           delta_path=str(tmp_path / 'delta.csv'))
+    run_units = refresh._run_units
+    batches = []
+
+    def interrupted_run_units(strategy, units):
+        batches.append(strategy)
+        if len(batches) == 3:
+            raise KeyboardInterrupt
+        return run_units(strategy, units)
+
+    refresh._run_units = interrupted_run_units
+    with pytest.raises(KeyboardInterrupt):
+        refresh.get_all_contacts_comprehensive()
+
+    assert refresh.refresh_stats['disappeared'] == 0
+    assert len(refresh.record_store) == found
+
+
+def test_cached_results_keep_full_text_after_a_crawl_that_dropped_it(make_scraper, tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    make_scraper('lean.sqlite', cache_path=cache_path, keep_full_text=False).get_all_contacts_comprehensive()
+
+    scraper = make_scraper('full.sqlite', cache_path=cache_path)
+    scraper.get_all_contacts_comprehensive()
+
+    assert all(record.get('full_text') for record in scraper.contact_data)
+
+
+def test_cancelled_pipeline_leaves_unstarted_searches_pending(server, make_scraper):
+    scraper = make_scraper()
+    server.latency = 0.05
+    units = [({'postal_code': f"{prefix:02d}"}, None) for prefix in range(1, 100)]
+    scraper.work_queue.enqueue('test', units)
+    pipeline = CrawlPipeline(scraper).start()
+    timer = threading.Timer(0.5, pipeline.cancel)
+    timer.start()
+    start = time.perf_counter()
+    try:
+        pipeline.run('test', units)
+    finally:
+        pipeline.stop()
+        timer.cancel()
+    elapsed = time.perf_counter() - start
+    counts = scraper.work_queue.counts()
+
+    # Crawling all of them takes more than 5 s at this latency
+    assert elapsed < 2
+    assert counts['pending'] > 50
+    assert 'in_flight' not in counts
+
+
+def test_new_crawl_refuses_to_delete_an_earlier_one(make_scraper):
+    scraper = make_scraper()
+    scraper.record_store.add([{'unique_id': 'a', 'name': 'A'}])
+    scraper.close()
+
+    with pytest.raises(FileExistsError):
+        make_scraper()
+    assert len(make_scraper(resume=True).record_store) == 1
+    assert len(make_scraper(fresh=True).record_store) == 0
@@ -0,0 +1,143 @@
+import pytest
+
+import datev_storage
+from datev_storage import QueryCache, RecordStore, WorkQueue, content_hash, stored_crawl
+
+
+def test_record_store_merges_a_repeat_into_the_stored_record(tmp_path):
+    store = RecordStore(str(tmp_path / 'crawl.sqlite'))
+    first = {'unique_id': 'hans_meyer_hauptstr_12', 'name': 'Hans Meyer', 'phone': '030 123', 'email': ''}
+    other = {'unique_id': 'erika_schulz_hauptstr_12', 'name': 'Erika Schulz'}
+    try:
+        assert store.add([first]) == 1
+        assert store.add([dict(first, phone='030 999', email='hm@example.de'), other]) == 1
+        records = list(store.records())
+        stored_hash = store.connection.execute(
+            "SELECT content_hash FROM records WHERE unique_id = ?", (first['unique_id'],)).fetchone()[0]
+    finally:
+        store.close()
+
+    # The stored record keeps its fields and takes the ones it lacked, in its place
+    merged = dict(first, email='hm@example.de')
+    assert records == [merged, other]
+    assert stored_hash == content_hash(merged)
+
+
+def test_record_store_merges_repeats_within_one_batch(tmp_path):
+    store = RecordStore(str(tmp_path / 'crawl.sqlite'))
+    try:
+        assert store.add([{'unique_id': 'a', 'name': 'A', 'phone': ''}, {'unique_id': 'a', 'phone': '030'}]) == 1
+        records = list(store.records())
+    finally:
+        store.close()
+
+    assert records == [{'unique_id': 'a', 'name': 'A', 'phone': '030'}]
+
+
+def test_stored_crawl_counts_searches_and_records(tmp_path):
+    path = str(tmp_path / 'crawl.sqlite')
+    assert stored_crawl(path) == (0, 0)
+
+    queue = WorkQueue(path)
+    store = RecordStore(path)
+    try:
+        queue.enqueue('city', [({'city': 'Berlin'}, None), ({'city': 'Hamburg'}, None)])
+        store.add([{'unique_id': 'a', 'name': 'A'}])
+    finally:
+        queue.close()
+        store.close()
+
+    assert stored_crawl(path) == (2, 1)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(datev_storage.time, 'time', clock)
+    return clock
+
+
+RECORDS = [{'unique_id': 'hans_meyer_hauptstr_12', 'name': 'Hans Meyer'}]
+
+
+def test_query_cache_round_trip(tmp_path, clock):
+    cache = QueryCache(str(tmp_path / 'cache.sqlite'))
+    try:
+        cache.put({'city': 'Köln', 'industries': ['b', 'a']}, ['<html>1</html>'], RECORDS, truncated=True)
+        hit = cache.get({'industries': ['a', 'b'], 'city': 'Köln'})
+        pages = cache.get_pages({'city': 'Köln', 'industries': ['a', 'b']})
+        miss = cache.get({'city': 'Köln'})
+        untruncated = (cache.put({'city': 'Bonn'}, [], RECORDS), cache.get({'city': 'Bonn'}))[1]
+    finally:
+        cache.close()
+
+    assert hit == (RECORDS, True)
+    assert pages == ['<html>1</html>']
+    assert miss is None
+    assert untruncated == (RECORDS, None)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_query_cache_entries_expire(tmp_path, clock):
+    cache = QueryCache(str(tmp_path / 'cache.sqlite'), ttl=60)
+    try:
+        cache.put({'city': 'Köln'}, [], RECORDS)
+        clock.now += 60
+        fresh = cache.get({'city': 'Köln'})
+        clock.now += 1
+        expired = cache.get({'city': 'Köln'})
+        size = cache.stats()['size_mb']
+        left = cache.connection.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+    finally:
+        cache.close()
+
+    assert fresh == (RECORDS, None)
+    assert expired is None
+    assert (size, left) == (0.0, 0)
+
+
+def test_query_cache_evicts_least_recently_used(tmp_path, clock):
+    cache = QueryCache(str(tmp_path / 'cache.sqlite'), ttl=0)
+    try:
+        cache.put({'city': 'Köln'}, ['x' * 1000], RECORDS)
+        # Room for two entries of this size
+        cache.max_bytes = cache._size * 2
+        clock.now += 1
+        cache.put({'city': 'Bonn'}, ['x' * 1000], RECORDS)
+        clock.now += 1
+        cache.get({'city': 'Köln'})
+        clock.now += 1
+        cache.put({'city': 'Essen'}, ['x' * 1000], RECORDS)
+        cached = {city: cache.get({'city': city}) is not None for city in ('Köln', 'Bonn', 'Essen')}
+    finally:
+        cache.close()
+
+    # Köln was read after Bonn was written
+    assert cached == {'Köln': True, 'Bonn': False, 'Essen': True}
+
+
+def test_query_cache_namespaces_are_separate(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite')
+    small_pages = QueryCache(path, namespace='https://example.de|10|')
+    large_pages = QueryCache(path, namespace='https://example.de|50|')
+    try:
+        small_pages.put({'city': 'Köln'}, ['<html>10</html>'], RECORDS)
+        large_miss = large_pages.get({'city': 'Köln'})
+        large_pages.put({'city': 'Köln'}, ['<html>50</html>'], RECORDS * 2)
+        small_hit = small_pages.get({'city': 'Köln'})
+        large_hit = large_pages.get({'city': 'Köln'})
+    finally:
+        small_pages.close()
+        large_pages.close()
+
+    assert large_miss is None
+    assert small_hit == (RECORDS, None)
+    assert large_hit == (RECORDS * 2, None)